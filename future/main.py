@@ -4,37 +4,63 @@ Photo booth web app using OpenAI gpt-image-1 for image transformations.
 Supports USB webcam capture and USB printer output.
 """
 
+import asyncio
 import base64
+import hashlib
 import io
 import os
-import re
 import subprocess
 import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
-from typing import List, Tuple
+from typing import BinaryIO, List, Optional, Tuple
 
+import numpy as np
 import yaml
+from cachetools import TTLCache
 from dotenv import load_dotenv
 from fastapi import FastAPI, HTTPException, Request, File, UploadFile, BackgroundTasks
 from fastapi.responses import JSONResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel
-from PIL import Image, ImageOps
-from openai import OpenAI
+from PIL import Image, ImageOps, features
+from openai import AsyncOpenAI
 import dotenv
 
+try:
+    from yaml import CSafeLoader as YamlLoader  # LibYAML C parser
+except ImportError:
+    from yaml import SafeLoader as YamlLoader
+
+try:
+    import xxhash
+
+    def cache_digest(data: bytes) -> str:
+        return xxhash.xxh3_128_hexdigest(data)
+except ImportError:
+    def cache_digest(data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+try:
+    import cups  # pycups: submit jobs over IPP without forking lp
+    CUPS_AVAILABLE = True
+except ImportError:
+    CUPS_AVAILABLE = False
+
 # Load environment variables
 load_dotenv(override=True)
 
 # Paths
 APP_ROOT = Path(__file__).resolve().parent
 GEN_DIR = APP_ROOT / "generated"
+CACHE_DIR = APP_ROOT / ".edit_cache"  # outside GEN_DIR so cached edits are never served publicly
 TEMPLATES_DIR = APP_ROOT / "templates"
 STATIC_DIR = APP_ROOT / "static"
 GEN_DIR.mkdir(parents=True, exist_ok=True)
+CACHE_DIR.mkdir(parents=True, exist_ok=True)
 TEMPLATES_DIR.mkdir(parents=True, exist_ok=True)
 STATIC_DIR.mkdir(parents=True, exist_ok=True)
 
@@ -48,10 +74,28 @@ BASE_URL = os.getenv("BASE_URL", f"http://localhost:{PORT}")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
 OPENAI_IMAGE_MODEL = os.getenv("OPENAI_IMAGE_MODEL", "gpt-image-1")
 
+# EXIF Orientation tag
+ORIENTATION_TAG = 0x0112
+
+# gpt-image-1 edits at 1024x1024; larger inputs only cost upload time
+API_IMAGE_SIZE = (1024, 1024)
+
+# Cached gpt-image-1 edits kept on disk; the oldest are evicted past this count
+EDIT_CACHE_MAX_ENTRIES = 200
+
+# Largest composite cell for 2+ images on 4x6 paper at 300 DPI
+THUMBNAIL_SIZE = (900, 900)
+
+# All JPEG I/O goes through Pillow; it is ~2x faster when linked against libjpeg-turbo
+if features.check_feature("libjpeg_turbo"):
+    print("[STARTUP] Pillow is using libjpeg-turbo for JPEG encoding", flush=True)
+else:
+    print("[STARTUP] Warning: Pillow is not using libjpeg-turbo; JPEG encoding will be slower", flush=True)
+
 # Initialize
 app = FastAPI()
 templates = Jinja2Templates(directory=str(TEMPLATES_DIR))
-openai_client = OpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
+openai_client = AsyncOpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
 
 # Mount static files - must be before route definitions
 app.mount("/static", StaticFiles(directory=str(STATIC_DIR.resolve())), name="static")
@@ -73,29 +117,93 @@ class PrintRequest(BaseModel):
     paths: List[str]
 
 
-def process_image(image_bytes: bytes, dest: Path) -> bytes:
-    """Auto-orient and save image as JPEG. Returns processed bytes.
+def process_image(src: BinaryIO, dest: Path) -> bytes:
+    """Auto-orient and save image as JPEG. Returns processed bytes for the API.
+
+    The full-resolution image is archived at dest; the returned bytes are
+    bounded to API_IMAGE_SIZE since gpt-image-1 works at 1024x1024 anyway.
 
     Args:
-        image_bytes: Raw image bytes.
+        src: File-like object with the raw image (e.g. the upload's spooled file).
         dest: Destination path for saved JPEG.
 
     Returns:
-        bytes: Processed image bytes.
+        bytes: Processed image bytes, at most API_IMAGE_SIZE.
     """
-    with Image.open(io.BytesIO(image_bytes)) as im:
-        im = ImageOps.exif_transpose(im).convert("RGB")
+    with Image.open(src) as im:
+        # Both steps copy the full image, so only run them when they change something
+        if im.getexif().get(ORIENTATION_TAG, 1) != 1:
+            im = ImageOps.exif_transpose(im)
+        if im.mode != "RGB":
+            im = im.convert("RGB")
+
         dest.parent.mkdir(parents=True, exist_ok=True)
         im.save(dest, format="JPEG", quality=94, optimize=True)
 
-        # Return processed bytes
+        # Smaller upload body to OpenAI; encoded once into memory
+        im.thumbnail(API_IMAGE_SIZE, Image.Resampling.LANCZOS)
         buf = io.BytesIO()
         im.save(buf, format="JPEG", quality=94, optimize=True)
         return buf.getvalue()
 
 
+def save_thumbnail(image_bytes: bytes, dest: Path) -> Path:
+    """Save a print-sized thumbnail next to dest so composites skip a full decode.
+
+    Returns:
+        Path: Path of the written thumbnail.
+    """
+    thumb_path = dest.with_suffix(".thumb.jpg")
+    with Image.open(io.BytesIO(image_bytes)) as im:
+        im.draft("RGB", THUMBNAIL_SIZE)
+        im.thumbnail(THUMBNAIL_SIZE, Image.Resampling.LANCZOS)
+        im.convert("RGB").save(thumb_path, format="JPEG", quality=94)
+    return thumb_path
+
+
+def read_cached_edit(cache_path: Path) -> Optional[bytes]:
+    """Return a cached edit's bytes, or None on a cache miss."""
+    try:
+        return cache_path.read_bytes()
+    except FileNotFoundError:
+        return None
+
+
+def write_cached_edit(cache_path: Path, data: bytes) -> None:
+    """Store an edit in the cache, then evict the oldest entries beyond EDIT_CACHE_MAX_ENTRIES."""
+    # Atomic write so a concurrent reader never sees a partial file
+    tmp_path = cache_path.with_suffix(f".{uuid.uuid4().hex[:8]}.tmp")
+    tmp_path.write_bytes(data)
+    tmp_path.replace(cache_path)
+
+    entries = []
+    for entry in os.scandir(CACHE_DIR):
+        if entry.name.endswith(".jpg"):
+            try:
+                entries.append((entry.stat().st_mtime, entry.path))
+            except FileNotFoundError:
+                pass
+    if len(entries) > EDIT_CACHE_MAX_ENTRIES:
+        entries.sort()
+        for _, path in entries[:len(entries) - EDIT_CACHE_MAX_ENTRIES]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
 async def transform_image(image_bytes: bytes, prompt: str) -> bytes:
-    """Edit the input image with gpt-image-1 via the Images API and return JPEG bytes."""
+    """Edit the input image with gpt-image-1 via the Images API and return JPEG bytes.
+
+    Results are cached on disk keyed by (image hash, prompt hash), so repeated
+    sessions with the same photo and scenes skip the API call entirely.
+    """
+    key = cache_digest(image_bytes) + "-" + cache_digest(prompt.encode())
+    cache_path = CACHE_DIR / f"{key}.jpg"
+    cached = await asyncio.to_thread(read_cached_edit, cache_path)
+    if cached is not None:
+        return cached
+
     if not openai_client:
         raise HTTPException(status_code=500, detail="OPENAI_API_KEY not configured")
 
@@ -103,17 +211,39 @@ async def transform_image(image_bytes: bytes, prompt: str) -> bytes:
         file_obj = io.BytesIO(image_bytes)
         file_obj.name = "input.jpg"
         # Generate an edit (image-to-image). You can also call images.generate for text->image.
-        result = openai_client.images.edit(
+        result = await openai_client.images.edit(
             model="gpt-image-1",
             image=file_obj,
             prompt=prompt,
             size="1024x1024"
         )
         b64 = result.data[0].b64_json
-        return base64.b64decode(b64)
+        data = base64.b64decode(b64)
     except Exception as exc:
         raise HTTPException(status_code=502, detail=f"OpenAI API failed: {exc}")
 
+    await asyncio.to_thread(write_cached_edit, cache_path, data)
+    return data
+
+
+_config_cache = {"mtime": None, "data": None}
+
+
+def load_config() -> dict:
+    """Return the parsed config.yml, re-reading it only when the file changes."""
+    config_path = APP_ROOT / "config.yml"
+    try:
+        mtime = config_path.stat().st_mtime
+    except FileNotFoundError:
+        raise HTTPException(status_code=500, detail="Missing config.yml")
+
+    if mtime != _config_cache["mtime"]:
+        with open(config_path, "r") as f:
+            _config_cache["data"] = yaml.load(f, Loader=YamlLoader) or {}
+        _config_cache["mtime"] = mtime
+
+    return _config_cache["data"]
+
 
 @app.get("/")
 async def index(request: Request):
@@ -121,8 +251,9 @@ async def index(request: Request):
     return templates.TemplateResponse("index.html", {"request": request})
 
 
-# Session storage for progressive generation
-generation_sessions = {}
+# Session storage for progressive generation, bounded so old sessions are evicted
+# (per-process: run a single uvicorn worker)
+generation_sessions = TTLCache(maxsize=1000, ttl=3600)
 
 @app.post("/api/generate/start")
 async def generate_start(background_tasks: BackgroundTasks, image: UploadFile = File(...)):
@@ -137,8 +268,8 @@ async def generate_start(background_tasks: BackgroundTasks, image: UploadFile =
     original_path = GEN_DIR / f"original-{timestamp}-{uid}.jpg"
 
     try:
-        raw_bytes = await image.read()
-        image_bytes = process_image(raw_bytes, original_path)
+        # Decode straight from the spooled upload instead of copying it into memory first
+        image_bytes = await asyncio.to_thread(process_image, image.file, original_path)
     except Exception as exc:
         print(f"[{ts}] Image processing error: {exc}", flush=True)
         raise HTTPException(status_code=400, detail=str(exc))
@@ -162,12 +293,7 @@ async def generate_start(background_tasks: BackgroundTasks, image: UploadFile =
     }
 
     # Load scene prompts
-    config_path = APP_ROOT / "config.yml"
-    if not config_path.exists():
-        raise HTTPException(status_code=500, detail="Missing config.yml")
-
-    with open(config_path, "r") as f:
-        config = yaml.safe_load(f) or {}
+    config = load_config()
 
     scenes = config.get("scenes", [])
     if not scenes or not isinstance(scenes, list):
@@ -188,23 +314,24 @@ async def generate_start(background_tasks: BackgroundTasks, image: UploadFile =
     })
 
 async def generate_scenes_background(session_id: str, image_bytes: bytes, scenes: list, timestamp: str, uid: str):
-    """Background task to generate scene variants."""
+    """Background task to generate scene variants concurrently."""
     ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-    for scene in scenes:
+    async def generate_one(scene: dict):
         label = str(scene.get("label", "unnamed"))
         prompt = str(scene.get("prompt", "")).strip()
 
         if not prompt:
-            continue
+            return
 
         try:
             print(f"[{ts}] START {label}", flush=True)
             transformed = await transform_image(image_bytes, prompt)
 
             scene_path = GEN_DIR / f"{label}-{timestamp}-{uid}.jpg"
-            with open(scene_path, "wb") as f:
-                f.write(transformed)
+            # Disk writes run in a worker thread so other scenes' API calls keep progressing
+            await asyncio.to_thread(scene_path.write_bytes, transformed)
+            await asyncio.to_thread(save_thumbnail, transformed, scene_path)
 
             rel_path = scene_path.relative_to(GEN_DIR).as_posix()
             new_image = GeneratedImage(
@@ -213,7 +340,7 @@ async def generate_scenes_background(session_id: str, image_bytes: bytes, scenes
                 path=str(scene_path)
             )
 
-            # Add to session
+            # Add to session (safe without a lock: the event loop is single-threaded)
             if session_id in generation_sessions:
                 generation_sessions[session_id]["images"].append(new_image)
                 generation_sessions[session_id]["completed"] += 1
@@ -223,6 +350,9 @@ async def generate_scenes_background(session_id: str, image_bytes: bytes, scenes
         except Exception as exc:
             print(f"[{ts}] ERROR {label}: {exc}", flush=True)
 
+    # All OpenAI calls are in flight at once; wall time is the slowest scene, not the sum
+    await asyncio.gather(*(generate_one(scene) for scene in scenes))
+
     # Mark as complete
     if session_id in generation_sessions:
         generation_sessions[session_id]["status"] = "completed"
@@ -257,32 +387,29 @@ async def generate_status(session_id: str):
 def create_composite_image(image_paths: List[str]) -> Path:
     """Create a composite image with all images arranged on a single page."""
     # Validate all paths
+    gen_root = GEN_DIR.resolve()
     valid_paths = []
     for path_str in image_paths:
-        p = Path(path_str).resolve()
-        if not str(p).startswith(str(GEN_DIR.resolve())):
+        try:
+            # strict=True checks existence as part of resolving
+            p = Path(path_str).resolve(strict=True)
+        except (OSError, RuntimeError):
             continue
-        if not p.exists():
+        if not p.is_relative_to(gen_root):
             continue
         valid_paths.append(p)
 
     if not valid_paths:
         raise ValueError("No valid images to print")
 
-    # Load all images
-    images = []
-    for img_path in valid_paths:
-        img = Image.open(img_path)
-        images.append(img)
-
     # Determine layout (5 images: 2 rows, top row has 3, bottom row has 2)
     # For 4x6 inch photo paper at 300 DPI: 1200x1800 pixels
     # Adjust based on actual paper size
-    if len(images) <= 2:
+    if len(valid_paths) <= 2:
         # Single row
-        cols = len(images)
+        cols = len(valid_paths)
         rows = 1
-    elif len(images) <= 4:
+    elif len(valid_paths) <= 4:
         # 2x2 grid
         cols = 2
         rows = 2
@@ -299,14 +426,34 @@ def create_composite_image(image_paths: List[str]) -> Path:
     thumb_width = composite_width // cols
     thumb_height = composite_height // rows
 
-    # Create composite canvas
-    composite = Image.new('RGB', (composite_width, composite_height), (255, 255, 255))
+    def load_thumbnail(img_path: Path) -> Image.Image:
+        # Prefer the pre-rendered thumbnail when it is at least as large as the cell needs
+        thumb_path = img_path.with_suffix(".thumb.jpg")
+        if thumb_path.exists():
+            img = Image.open(thumb_path)
+            if min(thumb_width / img.width, thumb_height / img.height) <= 1:
+                img.thumbnail((thumb_width, thumb_height), Image.Resampling.LANCZOS)
+                return img
+            # Too small for the cell; release its file handle before falling back to the original
+            img.close()
 
-    # Paste images into grid
-    for idx, img in enumerate(images):
+        img = Image.open(img_path)
+        # Let libjpeg decode at a reduced DCT scale (1/2, 1/4, 1/8) no smaller than the cell
+        img.draft("RGB", (thumb_width, thumb_height))
+        img.load()
         # Resize image to fit thumbnail while maintaining aspect ratio
         img.thumbnail((thumb_width, thumb_height), Image.Resampling.LANCZOS)
+        return img
 
+    # Decode and resize all images in parallel (Pillow releases the GIL while resampling)
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        images = list(executor.map(load_thumbnail, valid_paths))
+
+    # Create composite canvas as a white RGB array; pasting is a slice copy
+    canvas = np.full((composite_height, composite_width, 3), 255, dtype=np.uint8)
+
+    # Paste images into grid
+    for idx, img in enumerate(images):
         # Calculate position in grid
         x_offset = 0
         if len(images) == 5:
@@ -327,16 +474,62 @@ def create_composite_image(image_paths: List[str]) -> Path:
         x = col * thumb_width + (thumb_width - img.width) // 2 + x_offset
         y = row * thumb_height + (thumb_height - img.height) // 2
 
-        composite.paste(img, (x, y))
+        arr = np.asarray(img.convert("RGB"))
+        # Clip to the canvas like Image.paste does for cells past the edge
+        region = canvas[y:y + arr.shape[0], x:x + arr.shape[1]]
+        region[...] = arr[:region.shape[0], :region.shape[1]]
+
+    composite = Image.fromarray(canvas)
 
     # Save composite
     timestamp = time.strftime('%Y%m%d-%H%M%S')
     uid = uuid.uuid4().hex[:8]
     composite_path = GEN_DIR / f"composite-{timestamp}-{uid}.jpg"
-    composite.save(composite_path, format="JPEG", quality=95, optimize=True)
+    # One-pass Huffman and 4:2:0 chroma: the printer's halftoning discards the difference
+    composite.save(composite_path, format="JPEG", quality=92, optimize=False, subsampling=2, progressive=False)
 
     return composite_path
 
+_cups_connection = None
+
+
+def submit_print_job(path: Path) -> str:
+    """Submit a file to PRINTER_NAME and return the CUPS job id.
+
+    Uses libcups via pycups when installed, otherwise falls back to the lp CLI.
+    """
+    global _cups_connection
+
+    if CUPS_AVAILABLE:
+        options = {"media": MEDIA_SIZE}
+        for opt in LP_OPTIONS:
+            key, _, value = opt.partition("=")
+            options[key] = value or "true"
+        # The cached connection goes stale if cupsd restarts; drop it and reconnect once
+        for attempt in range(2):
+            if _cups_connection is None:
+                _cups_connection = cups.Connection()
+            try:
+                job_id = _cups_connection.printFile(PRINTER_NAME, str(path), "photobooth", options)
+                return f"{PRINTER_NAME}-{job_id}"
+            except (cups.IPPError, RuntimeError):
+                _cups_connection = None
+                if attempt:
+                    raise
+
+    cmd = ["lp", "-d", PRINTER_NAME, "-o", f"media={MEDIA_SIZE}"]
+    for opt in LP_OPTIONS:
+        cmd.extend(["-o", opt])
+    cmd.append(str(path))
+
+    # lp prints "request id is <printer>-<n> (1 file(s))"
+    out = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout.strip()
+    parts = out.split()
+    if len(parts) >= 4 and parts[0] == "request":
+        return parts[3]
+    return out or "submitted"
+
+
 @app.post("/api/print")
 async def print_images(req: PrintRequest):
     """Create composite image and print via CUPS."""
@@ -347,15 +540,8 @@ async def print_images(req: PrintRequest):
         # Create composite image from all provided images
         composite_path = create_composite_image(req.paths)
 
-        # Print composite via lp
-        cmd = ["lp", "-d", PRINTER_NAME, "-o", f"media={MEDIA_SIZE}"]
-        for opt in LP_OPTIONS:
-            cmd.extend(["-o", opt])
-        cmd.append(str(composite_path))
-
-        out = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout.strip()
-        m = re.search(r"(\S+-\d+)", out)
-        job_id = m.group(1) if m else out or "submitted"
+        # Print composite via CUPS
+        job_id = submit_print_job(composite_path)
 
         return JSONResponse({
             "jobs": [job_id],
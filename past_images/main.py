@@ -2,19 +2,120 @@
 Modal deployment for SAM + face_recognition + LaMa inpainting pipeline.
 Part of "Who Controls the Present" installation.
 
-Pipeline (from commit 79e55bb):
-1. SAM automatic mask generation
-2. Face recognition to find target person
-3. Select best mask containing face
-4. LaMa inpainting to remove person
+Pipeline:
+1. Face recognition to find target person
+2. SAM prompted with the face box to segment that person
+3. LaMa inpainting to remove person
+
+SAM_MODE=amg restores the original (commit 79e55bb) segmentation: SAM automatic
+mask generation followed by picking the largest mask that overlaps the face.
 """
 
 import modal
 import os
+import threading
+from pathlib import Path
+
+try:
+    # Only installed in the container image; the local `modal deploy` side skips the kernel
+    import numpy as np
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
 
 # Create Modal app
 app = modal.App("past-images")
 
+# Model paths (baked into the image at build time)
+SAM_CHECKPOINT = "/models/sam/sam_vit_h_4b8939.pth"
+SAM_SAFETENSORS = "/models/sam/sam_vit_h_4b8939.safetensors"
+SAM_ONNX_PATH = "/models/sam/onnx/sam_vith_encoder.onnx"
+SAM_TRT_PLAN = "/models/sam/sam_vith_bf16.plan"
+SAM_INPUT_SIZE = 1024
+
+# Volume mount points
+UPLOAD_DIR = Path("/app/uploads")
+OUTPUT_DIR = Path("/app/outputs")
+MASK_DIR = Path("/app/masks")
+
+# GPU containers a single request can fan out to
+MAX_CONTAINERS = 4
+
+
+if NUMBA_AVAILABLE:
+    @njit(parallel=True, cache=True)
+    def compute_overlaps(masks_stack, crop_top, crop_bottom, crop_left, crop_right):
+        """Count mask pixels inside the crop box for every mask in an (N, H, W) uint8 stack."""
+        n = masks_stack.shape[0]
+        counts = np.zeros(n, dtype=np.int64)
+        for i in prange(n):
+            total = 0
+            for y in range(crop_top, crop_bottom):
+                for x in range(crop_left, crop_right):
+                    if masks_stack[i, y, x] > 0:
+                        total += 1
+            counts[i] = total
+        return counts
+
+
+def convert_sam_checkpoint():
+    """
+    Re-save the SAM ViT-H pickle checkpoint as safetensors at image build time,
+    so containers mmap the weights instead of unpickling 2.4GB on every cold start.
+    """
+    import torch
+    from safetensors.torch import save_file
+
+    print("[BUILD] Converting SAM checkpoint to safetensors...")
+    state_dict = torch.load(SAM_CHECKPOINT, map_location="cpu")
+    save_file({k: v.contiguous() for k, v in state_dict.items()}, SAM_SAFETENSORS)
+    print(f"[BUILD] ✓ Wrote {SAM_SAFETENSORS}")
+
+
+def build_sam_trt_engine():
+    """
+    Export the SAM ViT-H image encoder to ONNX and compile a BF16 TensorRT plan.
+    Runs once at image build time on a GPU; the mask decoder stays in PyTorch.
+    """
+    from pathlib import Path
+
+    import tensorrt as trt
+    import torch
+    from segment_anything import sam_model_registry
+
+    print("[BUILD] Exporting SAM image encoder to ONNX...")
+    Path(SAM_ONNX_PATH).parent.mkdir(parents=True, exist_ok=True)
+    sam = sam_model_registry["default"](checkpoint=SAM_CHECKPOINT).eval()
+    dummy = torch.randn(1, 3, SAM_INPUT_SIZE, SAM_INPUT_SIZE)
+    with torch.inference_mode():
+        # ViT-H is >2GB, so weights land in external data files next to the graph
+        torch.onnx.export(
+            sam.image_encoder, dummy, SAM_ONNX_PATH,
+            input_names=["image"], output_names=["embeddings"], opset_version=17,
+        )
+
+    print("[BUILD] Building TensorRT BF16 engine...")
+    logger = trt.Logger(trt.Logger.WARNING)
+    builder = trt.Builder(logger)
+    network = builder.create_network(0)
+    parser = trt.OnnxParser(network, logger)
+    if not parser.parse_from_file(SAM_ONNX_PATH):
+        errors = [str(parser.get_error(i)) for i in range(parser.num_errors)]
+        raise RuntimeError(f"Failed to parse SAM encoder ONNX: {errors}")
+
+    config = builder.create_builder_config()
+    config.set_flag(trt.BuilderFlag.BF16)
+    config.set_flag(trt.BuilderFlag.FP16)
+    config.builder_optimization_level = 5
+    plan = builder.build_serialized_network(network, config)
+    if plan is None:
+        raise RuntimeError("TensorRT engine build failed")
+
+    with open(SAM_TRT_PLAN, "wb") as f:
+        f.write(plan)
+    print(f"[BUILD] ✓ Wrote {SAM_TRT_PLAN}")
+
 # Define the Modal image with dependencies
 image = (
     modal.Image.debian_slim(python_version="3.11")
@@ -59,6 +160,10 @@ image = (
         "ls -la /lama/big-lama/",
         "test -f /lama/big-lama/config.yaml && echo '✓ LaMa config.yaml found' || (echo '✗ LaMa config.yaml NOT FOUND' && exit 1)",
     )
+    .run_function(convert_sam_checkpoint)
+    # TensorRT for the SAM image encoder (engine is built on a GPU at image build time)
+    .pip_install("tensorrt==10.0.1", "onnx==1.15.0")
+    .run_function(build_sam_trt_engine, gpu="A100-80GB")
     .add_local_dir("templates", remote_path="/root/templates")
     .add_local_dir("static", remote_path="/root/static")
 )
@@ -68,51 +173,761 @@ uploads_volume = modal.Volume.from_name("uploads-past-images", create_if_missing
 outputs_volume = modal.Volume.from_name("outputs-past-images", create_if_missing=True)
 masks_volume = modal.Volume.from_name("masks-past-images", create_if_missing=True)
 
-@app.function(
+
+def initialize_models():
+    """
+    Load SAM and LaMa onto the GPU.
+    sam_generator.predictor serves box prompts directly; the AMG wrapper is only used with SAM_MODE=amg.
+    Called once per container from PastImages.load_models.
+    Returns: (sam_generator, lama_model)
+    """
+    import sys
+    from pathlib import Path
+
+    import numpy as np
+    import torch
+    from segment_anything import SamAutomaticMaskGenerator, SamPredictor, sam_model_registry
+
+    LAMA_DIR = Path("/lama")
+    LAMA_MODEL_DIR = LAMA_DIR / "big-lama"
+
+    class TrtImageEncoder(torch.nn.Module):
+        """Drop-in replacement for sam.image_encoder backed by a TensorRT engine."""
+
+        def __init__(self, plan_path: str):
+            super().__init__()
+            import tensorrt as trt
+
+            self._logger = trt.Logger(trt.Logger.WARNING)
+            with open(plan_path, "rb") as f:
+                self.engine = trt.Runtime(self._logger).deserialize_cuda_engine(f.read())
+            self.context = self.engine.create_execution_context()
+            # Persistent output buffer: (1, 256, 64, 64) embeddings for a 1024x1024 input
+            self.output = torch.empty(
+                tuple(self.engine.get_tensor_shape("embeddings")), dtype=torch.float32, device="cuda"
+            )
+
+        def forward(self, x: "torch.Tensor") -> "torch.Tensor":
+            # The engine is built for batch 1; run batched inputs one image at a time
+            outputs = []
+            for item in x.split(1):
+                item = item.contiguous().float()
+                self.context.set_tensor_address("image", item.data_ptr())
+                self.context.set_tensor_address("embeddings", self.output.data_ptr())
+                self.context.execute_async_v3(torch.cuda.current_stream().cuda_stream)
+                outputs.append(self.output.clone())
+            return torch.cat(outputs)
+
+    def load_trt_encoder(sam):
+        """Swap in the TensorRT encoder if the plan exists and matches PyTorch output."""
+        if not Path(SAM_TRT_PLAN).exists():
+            print("[INIT] No TensorRT plan found, using PyTorch SAM encoder")
+            return
+        try:
+            trt_encoder = TrtImageEncoder(SAM_TRT_PLAN)
+            probe = torch.randn(1, 3, SAM_INPUT_SIZE, SAM_INPUT_SIZE, device="cuda")
+            with torch.inference_mode():
+                expected = sam.image_encoder(probe)
+                actual = trt_encoder(probe)
+            similarity = torch.nn.functional.cosine_similarity(
+                expected.flatten(), actual.flatten(), dim=0
+            ).item()
+            if similarity < 0.99:
+                print(f"[INIT] TensorRT encoder parity check failed (cos={similarity:.4f}), keeping PyTorch")
+                return
+            sam.image_encoder = trt_encoder
+            print(f"[INIT] Using TensorRT BF16 SAM encoder (cos={similarity:.4f})")
+        except Exception as e:
+            print(f"[INIT] WARNING: TensorRT encoder unavailable, keeping PyTorch: {e}")
+
+    class PrecomputedSamPredictor(SamPredictor):
+        """SamPredictor that can reuse image embeddings computed in a batch."""
+
+        pending = None  # (original_size, input_size, features) for the next set_image
+
+        def set_image(self, image: np.ndarray, image_format: str = "RGB") -> None:
+            if self.pending is None:
+                return super().set_image(image, image_format)
+            self.reset_image()
+            self.original_size, self.input_size, self.features = self.pending
+            self.is_image_set = True
+            self.pending = None
+
+    def use_bf16_encoder(sam):
+        """Run the PyTorch SAM image encoder under inference_mode + BF16 autocast, compiled if possible."""
+        encoder_forward = sam.image_encoder.forward
+
+        def forward(x):
+            # SAM inputs are always 1024x1024, so cuDNN autotuning pays off here; it stays off
+            # for LaMa, whose inputs take each photo's own size (callers hold gpu_lock)
+            torch.backends.cudnn.benchmark = True
+            try:
+                with torch.inference_mode(), torch.autocast(device_type="cuda", dtype=torch.bfloat16):
+                    return encoder_forward(x).float()
+            finally:
+                torch.backends.cudnn.benchmark = False
+
+        # Inputs are always padded to 1024x1024, so inductor compiles one static graph per batch size
+        compiled_forward = torch.compile(encoder_forward, mode="max-autotune")
+        try:
+            probe = torch.zeros(1, 3, SAM_INPUT_SIZE, SAM_INPUT_SIZE, device="cuda")
+            with torch.inference_mode(), torch.autocast(device_type="cuda", dtype=torch.bfloat16):
+                compiled_forward(probe)
+            encoder_forward = compiled_forward
+            print("[INIT] SAM encoder compiled with torch.compile")
+        except Exception as e:
+            print(f"[INIT] WARNING: torch.compile failed for SAM encoder, running eager: {e}")
+
+        sam.image_encoder.forward = forward
+
+    def load_lama_model():
+        """Load the big-lama checkpoint in-process, the same way LaMa's bin/predict.py does."""
+        sys.path.insert(0, str(LAMA_DIR))
+        os.environ["TORCH_HOME"] = str(LAMA_DIR)
+        import yaml
+        from omegaconf import OmegaConf
+        from saicinpainting.training.trainers import load_checkpoint
+
+        with open(LAMA_MODEL_DIR / "config.yaml", "r") as f:
+            train_config = OmegaConf.create(yaml.safe_load(f))
+        train_config.training_model.predict_only = True
+        train_config.visualizer.kind = "noop"
+
+        model = load_checkpoint(
+            train_config, str(LAMA_MODEL_DIR / "models" / "best.ckpt"), strict=False, map_location="cpu"
+        )
+        model.freeze()
+        model.to("cuda")
+        return model
+
+    print("[INIT] Loading SAM ViT-H...")
+    if Path(SAM_SAFETENSORS).exists():
+        from safetensors.torch import load_file
+
+        sam = sam_model_registry["default"]()
+        sam.load_state_dict(load_file(SAM_SAFETENSORS))
+    else:
+        sam = sam_model_registry["default"](checkpoint=SAM_CHECKPOINT)
+    sam.to("cuda")
+    load_trt_encoder(sam)
+    if not isinstance(sam.image_encoder, TrtImageEncoder):
+        use_bf16_encoder(sam)
+    sam_generator = SamAutomaticMaskGenerator(sam)
+    sam_generator.predictor = PrecomputedSamPredictor(sam)
+    print("[INIT] SAM loaded")
+
+    print("[INIT] Loading LaMa big-lama...")
+    lama_model = load_lama_model()
+    print("[INIT] LaMa loaded")
+
+    return sam_generator, lama_model
+
+
+@app.cls(
     image=image,
     gpu="A100-80GB",
     timeout=1800,  # 30 minutes
     min_containers=1,  # Keep 1 container warm
-    max_containers=4,  # Max 4 GPUs
+    max_containers=MAX_CONTAINERS,  # Max 4 GPUs
     scaledown_window=300,
     volumes={
-        "/app/uploads": uploads_volume,
-        "/app/outputs": outputs_volume,
-        "/app/masks": masks_volume,
+        str(UPLOAD_DIR): uploads_volume,
+        str(OUTPUT_DIR): outputs_volume,
+        str(MASK_DIR): masks_volume,
     },
 )
+@modal.concurrent(max_inputs=4)  # decode one shard's uploads while another holds the GPU
+class PastImages:
+    """
+    GPU pipeline containers. The web app runs in its own function (fastapi_app), so
+    requests waiting on shards never hold the input slots those shards need.
+    """
+
+    @modal.enter()
+    def load_models(self):
+        """Load models before the container is marked ready, so no request pays for it."""
+        self.sam_generator, self.lama_model = initialize_models()
+        self.lama_bf16 = True  # cleared if LaMa's FFT layers reject BF16 on this GPU/torch build
+        # Concurrent inputs share one GPU and one SamPredictor; only decoding and saving overlap
+        self.gpu_lock = threading.Lock()
+        # dlib's shared HOG detector is not documented as thread-safe; HOG runs outside gpu_lock
+        self.hog_lock = threading.Lock()
+        self.build_pipeline()
+        print("[STARTUP] Warming up models...")
+        self.warmup()
+        if NUMBA_AVAILABLE:
+            # JIT (or load from cache) the overlap kernel now rather than on the first AMG request
+            compute_overlaps(np.zeros((1, 1, 1), dtype=np.uint8), 0, 1, 0, 1)
+        print("[STARTUP] All models loaded successfully!")
+
+    def build_pipeline(self):
+        """Define the pipeline steps as closures over the loaded models."""
+        import io
+        import shutil
+        import uuid
+        from concurrent.futures import ThreadPoolExecutor
+        from typing import List
+
+        import cv2
+        import numpy as np
+        import torch
+        from PIL import Image
+
+        import dlib
+        import face_recognition
+        from face_recognition import api as fr_api
+
+        for directory in [UPLOAD_DIR, OUTPUT_DIR, MASK_DIR]:
+            directory.mkdir(exist_ok=True, parents=True)
+
+        # "prompt": one SAM decoder call on the face box; "amg": automatic mask generation
+        SAM_MODE = os.environ.get("SAM_MODE", "prompt")
+
+        # Dump every SAM mask as PNG to the masks volume (slow; debugging only)
+        DEBUG_SAVE_MASKS = os.environ.get("DEBUG_SAVE_MASKS", "0") == "1"
+        MASK_STAGING_DIR = Path("/dev/shm/masks_debug")
+
+        # ============================================================================
+        # STEP 1: SAM SEGMENTATION
+        # ============================================================================
+
+        def prepare_sam_input(image_rgb: np.ndarray) -> tuple:
+            """
+            Resize to at most SAM_INPUT_SIZE on the long side,
+            which is the resolution SAM works at internally anyway.
+            Returns: (RGB uint8 array, scale)
+            """
+            print(f"[STEP 1] Image array shape: {image_rgb.shape}, dtype: {image_rgb.dtype}, contiguous: {image_rgb.flags['C_CONTIGUOUS']}")
+
+            # Downsample so AMG's point grid runs at SAM's native resolution
+            scale = SAM_INPUT_SIZE / max(image_rgb.shape[:2])
+            if scale < 1:
+                new_size = (round(image_rgb.shape[1] * scale), round(image_rgb.shape[0] * scale))
+                image_rgb = cv2.resize(image_rgb, new_size, interpolation=cv2.INTER_AREA)
+                print(f"[STEP 1] Resized to {image_rgb.shape[1]}x{image_rgb.shape[0]} for SAM")
+            else:
+                scale = 1.0
+            return image_rgb, scale
+
+        def encode_images_batch(images_rgb: List[np.ndarray]) -> List[tuple]:
+            """
+            Run the SAM image encoder once over all images.
+            Returns: [(original_size, input_size, features), ...] ready for PrecomputedSamPredictor
+            """
+            predictor = self.sam_generator.predictor
+
+            sizes = []
+            batch = []
+            for image_rgb in images_rgb:
+                transformed = predictor.transform.apply_image(image_rgb)
+                tensor = torch.as_tensor(transformed, device=predictor.device).permute(2, 0, 1).contiguous()
+                sizes.append((image_rgb.shape[:2], tuple(tensor.shape[-2:])))
+                batch.append(predictor.model.preprocess(tensor[None]))
+
+            with torch.inference_mode():
+                features = predictor.model.image_encoder(torch.cat(batch))
+            print(f"[STEP 1] Encoded {len(images_rgb)} image(s) in one batch")
+
+            return [
+                (original_size, input_size, features[i:i + 1])
+                for i, (original_size, input_size) in enumerate(sizes)
+            ]
+
+        def segment_person(image_rgb: np.ndarray, embedding: tuple, face_bbox: dict) -> np.ndarray:
+            """
+            STEP 1 (prompt mode): Segment the person with a single SAM decoder call on the face box.
+            Takes the output of prepare_sam_input, its precomputed embedding and a face bbox in the same space.
+            Returns: (h, w) uint8 0/1 mask
+            """
+            print(f"[STEP 1] Segmenting person with SAM box prompt...")
+
+            predictor = self.sam_generator.predictor
+            predictor.pending = embedding
+            predictor.set_image(image_rgb)
+
+            box = np.array([face_bbox['left'], face_bbox['top'], face_bbox['right'], face_bbox['bottom']])
+            masks, scores, _ = predictor.predict(box=box, multimask_output=True)
+
+            # The largest of the multimask outputs is usually the whole person rather than just the face
+            areas = masks.reshape(len(masks), -1).sum(axis=1)
+            best = int(np.argmax(areas))
+            print(f"[STEP 1] ✓ Selected mask {best}: area={areas[best]}, score={scores[best]:.3f}")
+
+            return masks[best].view(np.uint8)
+
+        def segment_image(image_rgb: np.ndarray, session_id: str, embedding: tuple = None) -> tuple:
+            """
+            STEP 1 (amg mode): Segment image using SAM automatic mask generation.
+            Takes the output of prepare_sam_input and, optionally, a precomputed embedding.
+            Returns: (list of mask dictionaries, (N, h, w) uint8 mask stack)
+            """
+            print(f"[STEP 1] Segmenting image with SAM...")
+
+            # Generate masks
+            generator = self.sam_generator
+            generator.predictor.pending = embedding
+            masks = generator.generate(image_rgb)
+            print(f"[STEP 1] Generated {len(masks)} masks")
+
+            # Keep all masks in one contiguous (N, H, W) array for vectorized selection
+            if masks:
+                masks_stack = np.stack([m['segmentation'] for m in masks]).view(np.uint8)
+            else:
+                masks_stack = np.zeros((0, *image_rgb.shape[:2]), dtype=np.uint8)
+
+            if DEBUG_SAVE_MASKS:
+                save_debug_masks(masks, masks_stack, session_id)
+
+            return masks, masks_stack
+
+        def save_debug_masks(masks: List[dict], masks_stack: np.ndarray, session_id: str):
+            """Save mask PNGs and metadata to the masks volume for debugging."""
+            # Encode into RAM-backed /dev/shm, then copy the finished directory to the volume in one pass
+            mask_session_dir = MASK_STAGING_DIR / session_id
+            mask_session_dir.mkdir(exist_ok=True, parents=True)
+
+            def write_mask(i: int):
+                # Save binary mask; the stack is already uint8, so this is a single scaling pass
+                cv2.imwrite(str(mask_session_dir / f"mask_{i}.png"), masks_stack[i] * np.uint8(255))
+
+            # OpenCV releases the GIL while encoding PNGs, so the writes run in parallel
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                list(executor.map(write_mask, range(len(masks_stack))))
+
+            # Save metadata
+            metadata_path = mask_session_dir / "mask_metadata.txt"
+            with open(metadata_path, "w") as f:
+                f.write("Mask Metadata:\n")
+                f.write("=" * 50 + "\n")
+                for i, mask_data in enumerate(masks):
+                    f.write(f"\nMask {i}:\n")
+                    f.write(f"  Area: {mask_data['area']} pixels\n")
+                    f.write(f"  Bbox (XYWH): {mask_data['bbox']}\n")
+                    f.write(f"  Predicted IoU: {mask_data['predicted_iou']:.4f}\n")
+                    f.write(f"  Stability Score: {mask_data['stability_score']:.4f}\n")
+
+            shutil.copytree(mask_session_dir, MASK_DIR / session_id, dirs_exist_ok=True)
+            shutil.rmtree(mask_session_dir, ignore_errors=True)
+
+        # ============================================================================
+        # STEP 2: FACE RECOGNITION
+        # ============================================================================
+
+        def hog_face_locations(img: np.ndarray) -> List[tuple]:
+            """Detect faces with dlib's CPU HOG detector; enough for the large, frontal faces this installation sees."""
+            with self.hog_lock:
+                rects = fr_api.face_detector(img, 1)
+            return [fr_api._trim_css_to_bounds(fr_api._rect_to_css(r), img.shape) for r in rects]
+
+        def detect_and_encode_faces(images: List[np.ndarray], hog_locations: List[List[tuple]] = None) -> List[tuple]:
+            """
+            Detect faces with HOG, falling back to one batched CNN pass for images where HOG
+            finds nothing, then encode every face with one batched ResNet descriptor pass.
+            hog_locations: optional hog_face_locations results computed ahead of time
+            Returns: [(locations, encodings), ...] per image, locations as (top, right, bottom, left)
+            """
+            if hog_locations is None:
+                hog_locations = [hog_face_locations(img) for img in images]
+            per_image_locations = list(hog_locations)
+
+            # The CNN detector is ~10x slower; only needed for small or side-on faces HOG misses
+            missing = [i for i, locations in enumerate(per_image_locations) if not locations]
+            if missing:
+                cnn_images = [images[i] for i in missing]
+                # dlib's batched detector needs equally sized images; zero padding adds no faces
+                max_h = max(img.shape[0] for img in cnn_images)
+                max_w = max(img.shape[1] for img in cnn_images)
+                padded = [
+                    img if img.shape[:2] == (max_h, max_w)
+                    else np.pad(img, ((0, max_h - img.shape[0]), (0, max_w - img.shape[1]), (0, 0)))
+                    for img in cnn_images
+                ]
+                detections = fr_api.cnn_face_detector(padded, 1, batch_size=len(padded))
+                for i, img, dets in zip(missing, cnn_images, detections):
+                    per_image_locations[i] = [
+                        fr_api._trim_css_to_bounds(fr_api._rect_to_css(d.rect), img.shape) for d in dets
+                    ]
+
+            batch_images = []
+            batch_shapes = []
+            for img, locations in zip(images, per_image_locations):
+                if locations:
+                    shapes = dlib.full_object_detections()
+                    for loc in locations:
+                        shapes.append(fr_api.pose_predictor_5_point(img, fr_api._css_to_rect(loc)))
+                    batch_images.append(img)
+                    batch_shapes.append(shapes)
+
+            descriptors = fr_api.face_encoder.compute_face_descriptor(batch_images, batch_shapes, 1) if batch_images else []
+
+            results = []
+            descriptor_iter = iter(descriptors)
+            for locations in per_image_locations:
+                encodings = [np.array(d) for d in next(descriptor_iter)] if locations else []
+                results.append((locations, encodings))
+            return results
+
+        def encode_reference_face(query_rgb: np.ndarray) -> np.ndarray:
+            """
+            Encode the reference face once per request (largest face if several).
+            Returns: 128-d face encoding
+            """
+            with self.gpu_lock:
+                [(query_locations, query_encodings)] = detect_and_encode_faces([query_rgb])
+
+            if len(query_locations) == 0:
+                raise ValueError("No faces found in query image")
+
+            # Use largest face if multiple
+            largest_idx = 0
+            if len(query_locations) > 1:
+                print(f"[STEP 2] Found {len(query_locations)} faces in query, using largest")
+                face_areas = [
+                    ((bottom - top) * (right - left), idx)
+                    for idx, (top, right, bottom, left) in enumerate(query_locations)
+                ]
+                face_areas.sort(reverse=True)
+                largest_idx = face_areas[0][1]
+
+            return query_encodings[largest_idx]
+
+        def find_matching_face(target_rgb: np.ndarray, query_encoding: np.ndarray, hog_locations: List[tuple] = None) -> dict:
+            """
+            STEP 2: Find matching face in target image based on the reference encoding.
+            hog_locations: optional HOG detections for the target, computed ahead of time
+            Returns: Face bbox dict or None
+            """
+            print(f"[STEP 2] Finding matching face...")
+
+            [(target_locations, target_encodings)] = detect_and_encode_faces(
+                [target_rgb], None if hog_locations is None else [hog_locations]
+            )
+
+            # Compare faces
+            distances = face_recognition.face_distance(target_encodings, query_encoding)
+            threshold = 0.6
+            matches = distances <= threshold
+
+            # Find best match
+            for i, ((top, right, bottom, left), is_match, dist) in enumerate(zip(target_locations, matches, distances)):
+                if is_match:
+                    print(f"[STEP 2] Match found! Distance: {dist:.3f}")
+                    return {
+                        'top': int(top),
+                        'right': int(right),
+                        'bottom': int(bottom),
+                        'left': int(left),
+                        'distance': float(dist)
+                    }
+
+            print(f"[STEP 2] No matching face found (threshold={threshold})")
+            return None
+
+        # ============================================================================
+        # STEP 3: SELECT BEST MASK
+        # ============================================================================
+
+        def select_best_mask(masks: List[dict], masks_stack: np.ndarray, face_bbox: dict) -> int:
+            """
+            STEP 3 (amg mode): Select the largest mask that has overlap with the detected face.
+        
+            Strategy:
+            1. Calculate overlap area between face bbox and each mask
+            2. Filter masks with significant overlap (>10% of face area)
+            3. Select the largest mask from those with overlap
+        
+            Returns: mask index
+            """
+            print(f"[STEP 3] Selecting best mask from {len(masks)} candidates...")
+
+            # Calculate face area and bbox
+            face_left = face_bbox['left']
+            face_right = face_bbox['right']
+            face_top = face_bbox['top']
+            face_bottom = face_bbox['bottom']
+            face_area = (face_right - face_left) * (face_bottom - face_top)
+        
+            print(f"[STEP 3] Face bbox: ({face_left}, {face_top}) to ({face_right}, {face_bottom}), area={face_area}")
+
+            n, h, w = masks_stack.shape
+            areas = np.array([m['area'] for m in masks], dtype=np.int64)
+
+            # Crop all masks to the face bbox region at once
+            crop_top = max(0, face_top)
+            crop_bottom = min(h, face_bottom)
+            crop_left = max(0, face_left)
+            crop_right = min(w, face_right)
+
+            # Count pixels in the face region that are part of each mask, for all masks in one op
+            overlap_counts = np.zeros(n, dtype=np.int64)
+            if crop_top < crop_bottom and crop_left < crop_right:
+                if NUMBA_AVAILABLE:
+                    overlap_counts = compute_overlaps(masks_stack, crop_top, crop_bottom, crop_left, crop_right)
+                else:
+                    overlap_counts = np.count_nonzero(
+                        masks_stack[:, crop_top:crop_bottom, crop_left:crop_right], axis=(1, 2)
+                    )
+            overlap_percentages = overlap_counts * 100.0 / face_area if face_area > 0 else np.zeros(n)
+
+            # Only consider masks with at least 10% overlap with face
+            candidates = np.flatnonzero(overlap_percentages >= 10)
+            for i in candidates:
+                print(f"  Mask {i}: Overlap={overlap_percentages[i]:.1f}%, Mask area={areas[i]}")
+
+            if len(candidates) == 0:
+                print(f"[STEP 3] WARNING: No masks with >10% overlap. Trying with face center point...")
+                # Fallback: just check if face center is in mask
+                face_center_x = (face_left + face_right) // 2
+                face_center_y = (face_top + face_bottom) // 2
+
+                if 0 <= face_center_y < h and 0 <= face_center_x < w:
+                    candidates = np.flatnonzero(masks_stack[:, face_center_y, face_center_x])
+
+                if len(candidates) == 0:
+                    raise ValueError("No masks overlap with the detected face")
+
+            # Select the mask with the LARGEST AREA that has overlap
+            best = int(candidates[np.argmax(areas[candidates])])
+            print(f"[STEP 3] ✓ Selected mask {best}: area={areas[best]}, overlap={overlap_percentages[best]:.1f}%")
+
+            return best
+
+        # ============================================================================
+        # STEP 4: LAMA INPAINTING
+        # ============================================================================
+
+        def inpaint_with_lama(image_rgb: np.ndarray, mask: np.ndarray, session_id: str, device: str = "cuda") -> np.ndarray:
+            """
+            STEP 4: Inpaint using LaMa (in-process, model stays resident on the GPU).
+            Takes a 2D uint8 mask at image resolution; nonzero pixels are removed.
+            Returns: Inpainted RGB uint8 array
+            """
+            print(f"[STEP 4] Inpainting with LaMa...")
+
+            image_array = image_rgb.astype(np.float32) / 255.0
+            print(f"[STEP 4] Mask array dtype: {mask.dtype}, shape: {mask.shape}")
+            mask_array = (mask > 0).astype(np.float32)
+
+            # LaMa needs spatial dims divisible by 8; pad like its dataset loader does
+            h, w = mask_array.shape
+            pad_h = (-h) % 8
+            pad_w = (-w) % 8
+            if pad_h or pad_w:
+                image_array = np.pad(image_array, ((0, pad_h), (0, pad_w), (0, 0)), mode="symmetric")
+                mask_array = np.pad(mask_array, ((0, pad_h), (0, pad_w)), mode="symmetric")
+
+            batch = {
+                "image": torch.from_numpy(image_array).permute(2, 0, 1).unsqueeze(0).to(device),
+                "mask": torch.from_numpy(mask_array)[None, None].to(device),
+            }
+
+            print(f"[STEP 4] Running LaMa...")
+            with torch.inference_mode():
+                try:
+                    with torch.autocast(device_type="cuda", dtype=torch.bfloat16, enabled=self.lama_bf16):
+                        inpainted = self.lama_model(batch)["inpainted"]
+                except torch.cuda.OutOfMemoryError:
+                    # Not a dtype problem; FP32 would only need more memory
+                    raise
+                except RuntimeError as e:
+                    # Only fall back when an op has no BF16 kernel (e.g. cuFFT on some builds)
+                    message = str(e).lower()
+                    if not self.lama_bf16 or not any(
+                        marker in message for marker in ("bfloat16", "half precision", "unsupported dtype", "not implemented for")
+                    ):
+                        raise
+                    print(f"[STEP 4] BF16 autocast failed ({e}), falling back to FP32")
+                    self.lama_bf16 = False
+                    inpainted = self.lama_model(batch)["inpainted"]
+
+            result_array = inpainted[0].float().permute(1, 2, 0)[:h, :w].cpu().numpy()
+            result_array = np.clip(result_array * 255, 0, 255).astype(np.uint8)
+
+            # Verify dimensions
+            print(f"[STEP 4] Result image shape: {result_array.shape}")
+
+            print(f"[STEP 4] Inpainting complete")
+            return result_array
+
+        # ============================================================================
+        # BATCH PROCESSING
+        # ============================================================================
+
+        def process_batch(session_id: str, ref_encoding: np.ndarray, batch: List[tuple]) -> List[tuple]:
+            """
+            Run steps 1-4 on a batch of (idx, filename, bytes) targets in this container.
+            Returns: [(idx, result dict), ...]
+            """
+            results = []
+
+            # Load all targets up front so SAM can encode them in one batch
+            loaded = []
+            for idx, filename, target_content in batch:
+                try:
+                    target_pil = Image.open(io.BytesIO(target_content))
+                    target_rgb = np.asarray(target_pil.convert('RGB'))
+                    print(f"[API] Loaded target image: {filename}, size: {target_pil.size}")
+                    sam_input, scale = prepare_sam_input(target_rgb)
+                    loaded.append((idx, filename, target_rgb, sam_input, scale))
+                except Exception as e:
+                    print(f"[API] ✗ Image {idx} failed to load: {str(e)}")
+                    results.append((idx, {"original": filename, "error": str(e)}))
+
+            # HOG face detection runs on the CPU while SAM encodes the batch on the GPU
+            # (one worker: hog_lock serializes the shared detector across concurrent inputs anyway)
+            with ThreadPoolExecutor(max_workers=1) as hog_pool:
+                hog_futures = [hog_pool.submit(hog_face_locations, target_rgb) for _, _, target_rgb, _, _ in loaded]
+                with self.gpu_lock:
+                    embeddings = encode_images_batch([sam_input for _, _, _, sam_input, _ in loaded]) if loaded else []
+                hog_results = [future.result() for future in hog_futures]
+
+            for (idx, filename, target_rgb, sam_input, scale), embedding, hog_locations in zip(loaded, embeddings, hog_results):
+                try:
+                    print(f"\n[API] Processing image {idx+1}: {filename}")
+
+                    with self.gpu_lock:
+                        # STEP 2: Find face (first, so SAM can be prompted with it)
+                        face_bbox = find_matching_face(target_rgb, ref_encoding, hog_locations)
+                        if face_bbox is None:
+                            raise ValueError("No matching face found")
+
+                        # SAM works at SAM resolution; bring the face bbox into the same space
+                        scaled_bbox = {k: int(face_bbox[k] * scale) for k in ('top', 'right', 'bottom', 'left')}
+
+                        if SAM_MODE == "amg":
+                            # STEP 1: Segment everything, STEP 3: select the mask over the face
+                            masks, masks_stack = segment_image(sam_input, f"{session_id}_{idx}", embedding)
+                            mask_idx = select_best_mask(masks, masks_stack, scaled_bbox)
+                            person_mask = masks_stack[mask_idx]
+                        else:
+                            # STEP 1: One prompted decoder call replaces AMG + mask selection
+                            person_mask = segment_person(sam_input, embedding, scaled_bbox)
+
+                        # Selected 0/1 mask, upsampled back to the original size
+                        mask_array = person_mask
+                        if scale < 1:
+                            mask_array = cv2.resize(mask_array, (target_rgb.shape[1], target_rgb.shape[0]), interpolation=cv2.INTER_NEAREST)
+
+                        # STEP 4: Inpaint
+                        result_image = inpaint_with_lama(target_rgb, mask_array, f"{session_id}_{idx}")
+
+                    # Save result with proper format
+                    output_filename = f"{session_id}_{idx}_{uuid.uuid4()}.jpg"
+                    output_path = OUTPUT_DIR / output_filename
+
+                    # OpenCV's bundled libjpeg-turbo encodes with SIMD, unlike PIL's libjpeg here
+                    saved = cv2.imwrite(
+                        str(output_path),
+                        cv2.cvtColor(result_image, cv2.COLOR_RGB2BGR),
+                        [cv2.IMWRITE_JPEG_QUALITY, 95],
+                    )
+
+                    # Verify file was saved
+                    if not saved or not output_path.exists():
+                        raise RuntimeError(f"Failed to save output file: {output_path}")
+
+                    file_size = output_path.stat().st_size
+                    if file_size == 0:
+                        raise RuntimeError(f"Output file is empty: {output_path}")
+                    print(f"[API] Saved result to {output_path} ({file_size} bytes)")
+
+                    results.append((idx, {
+                        "original": filename,
+                        "output": output_filename,
+                        "url": f"/outputs/{output_filename}"
+                    }))
+
+                    print(f"[API] ✓ Image {idx} processed successfully")
+
+                except Exception as e:
+                    print(f"[API] ✗ Image {idx} failed: {str(e)}")
+                    import traceback
+                    traceback.print_exc()
+                    results.append((idx, {
+                        "original": filename,
+                        "error": str(e)
+                    }))
+
+            # One commit per shard makes the outputs visible to the web container
+            outputs_volume.commit()
+            if DEBUG_SAVE_MASKS:
+                masks_volume.commit()
+            return results
+
+        def warmup():
+            """Run every model once on a blank image so autotuning and allocator growth happen before traffic."""
+            blank = np.zeros((SAM_INPUT_SIZE, SAM_INPUT_SIZE, 3), dtype=np.uint8)
+            half = SAM_INPUT_SIZE // 2
+            with self.gpu_lock:
+                detect_and_encode_faces([blank])
+                [embedding] = encode_images_batch([blank])
+                segment_person(blank, embedding, {'top': 0, 'right': half, 'bottom': half, 'left': 0})
+                inpaint_with_lama(blank, np.ones(blank.shape[:2], dtype=np.uint8), "warmup")
+
+        self.encode_reference_face = encode_reference_face
+        self.process_batch = process_batch
+        self.warmup = warmup
+
+    def decode_and_encode_reference(self, filename: str, content: bytes):
+        """Decode a reference upload and return its face encoding as a float64 array."""
+        import io
+
+        import numpy as np
+        from PIL import Image
+
+        ref_rgb = np.asarray(Image.open(io.BytesIO(content)).convert('RGB'))
+        print(f"[API] Loaded reference image: {filename}, size: {ref_rgb.shape[1]}x{ref_rgb.shape[0]}")
+        return self.encode_reference_face(ref_rgb).astype(np.float64)
+
+    @modal.method()
+    def encode_reference(self, filename: str, content: bytes) -> bytes:
+        """Decode a reference upload and return its face encoding as float64 bytes."""
+        return self.decode_and_encode_reference(filename, content).tobytes()
+
+    @modal.method()
+    def process_targets(self, session_id: str, ref_encoding: bytes | None, batch: list,
+                        reference: tuple | None = None) -> list:
+        """Process one shard of a request's targets; fanned out from /api/process with .map.
+
+        A single-shard request passes the raw (filename, bytes) reference instead of an
+        encoding so the reference is encoded here, saving a separate GPU round-trip.
+        """
+        import numpy as np
+
+        if reference is not None:
+            ref_array = self.decode_and_encode_reference(*reference)
+        else:
+            ref_array = np.frombuffer(ref_encoding, dtype=np.float64)
+        return self.process_batch(session_id, ref_array, batch)
+
+
+@app.function(
+    image=image,
+    min_containers=1,  # Keep the web endpoint warm
+    scaledown_window=300,
+    volumes={str(OUTPUT_DIR): outputs_volume},
+)
+@modal.concurrent(max_inputs=32)  # requests only await the GPU pool, so many fit in one container
 @modal.asgi_app(label="past-images-web")
 def fastapi_app():
     """
     Person removal pipeline with SAM + face_recognition + LaMa.
 
     Pipeline steps:
-    1. SEGMENTATION: SAM automatic mask generation
-    2. FACE MATCHING: Find target person using face_recognition
-    3. MASK SELECTION: Select best mask containing face
-    4. INPAINTING: LaMa removes person
+    1. FACE MATCHING: Find target person using face_recognition
+    2. SEGMENTATION: SAM prompted with the face box (or AMG + mask selection)
+    3. INPAINTING: LaMa removes person
     """
-    import io
     import uuid
     import json
-    import shutil
-    import subprocess
-    import sys
     from pathlib import Path
     from typing import List
-    import asyncio
 
-    import cv2
-    import numpy as np
     from fastapi import FastAPI, File, UploadFile, HTTPException, Request
     from fastapi.responses import FileResponse, JSONResponse, HTMLResponse
     from fastapi.staticfiles import StaticFiles
     from fastapi.templating import Jinja2Templates
     from starlette.middleware.cors import CORSMiddleware
-    from PIL import Image
-
-    from segment_anything import SamAutomaticMaskGenerator, sam_model_registry
-    import face_recognition
 
     # Initialize FastAPI
     web_app = FastAPI(title="Past Images - SAM+LaMa", version="4.0.0")
@@ -127,359 +942,9 @@ def fastapi_app():
         allow_headers=["*"],
     )
 
-    # Configuration
-    UPLOAD_DIR = Path("/app/uploads")
-    OUTPUT_DIR = Path("/app/outputs")
-    MASK_DIR = Path("/app/masks")
-    for directory in [UPLOAD_DIR, OUTPUT_DIR, MASK_DIR]:
-        directory.mkdir(exist_ok=True, parents=True)
-
-    SAM_CHECKPOINT = "/models/sam/sam_vit_h_4b8939.pth"
-    LAMA_DIR = Path("/lama")
-    LAMA_MODEL_DIR = LAMA_DIR / "big-lama"
-
-    # Model initialization
-    import threading
-    _model_lock = threading.Lock()
-    _models_loaded = False
-    sam_generator = None
-
-    def initialize_models():
-        """Initialize SAM model (lazy loading)."""
-        nonlocal sam_generator, _models_loaded
-
-        with _model_lock:
-            if _models_loaded:
-                return sam_generator
-
-            print("[INIT] Loading SAM ViT-H...")
-            sam = sam_model_registry["default"](checkpoint=SAM_CHECKPOINT)
-            sam.to("cuda")
-            sam_generator = SamAutomaticMaskGenerator(sam)
-            print("[INIT] SAM loaded")
-
-            _models_loaded = True
-            return sam_generator
-
-    # Startup event to warm up models
-    @web_app.on_event("startup")
-    def startup_event():
-        """Warm up models when container starts."""
-        print("[STARTUP] Warming up models...")
-        try:
-            initialize_models()
-            print("[STARTUP] All models loaded successfully!")
-        except Exception as e:
-            print(f"[STARTUP] ERROR: Failed to warm up models: {e}")
-            import traceback
-            traceback.print_exc()
-
-    # ============================================================================
-    # STEP 1: SAM SEGMENTATION
-    # ============================================================================
-
-    def segment_image(image: Image.Image, session_id: str) -> List[dict]:
-        """
-        STEP 1: Segment image using SAM automatic mask generation.
-        Returns: List of mask dictionaries
-        """
-        print(f"[STEP 1] Segmenting image with SAM...")
-
-        # Ensure models are loaded
-        generator = sam_generator if sam_generator else initialize_models()
-
-        # Convert to RGB numpy array with explicit dtype and ensure contiguous memory
-        image_rgb = np.ascontiguousarray(image.convert("RGB"), dtype=np.uint8)
-        print(f"[STEP 1] Image array shape: {image_rgb.shape}, dtype: {image_rgb.dtype}, contiguous: {image_rgb.flags['C_CONTIGUOUS']}")
-
-        # Generate masks
-        masks = generator.generate(image_rgb)
-        print(f"[STEP 1] Generated {len(masks)} masks")
-
-        # Save masks to volume for debugging
-        mask_session_dir = MASK_DIR / session_id
-        mask_session_dir.mkdir(exist_ok=True, parents=True)
-
-        for i, mask_data in enumerate(masks):
-            # Save binary mask
-            mask_uint8 = mask_data['segmentation'].astype(np.uint8) * 255
-            mask_path = mask_session_dir / f"mask_{i}.png"
-            cv2.imwrite(str(mask_path), mask_uint8)
-
-        # Save metadata
-        metadata_path = mask_session_dir / "mask_metadata.txt"
-        with open(metadata_path, "w") as f:
-            f.write("Mask Metadata:\n")
-            f.write("=" * 50 + "\n")
-            for i, mask_data in enumerate(masks):
-                f.write(f"\nMask {i}:\n")
-                f.write(f"  Area: {mask_data['area']} pixels\n")
-                f.write(f"  Bbox (XYWH): {mask_data['bbox']}\n")
-                f.write(f"  Predicted IoU: {mask_data['predicted_iou']:.4f}\n")
-                f.write(f"  Stability Score: {mask_data['stability_score']:.4f}\n")
-
-        masks_volume.commit()
-        return masks
-
-    # ============================================================================
-    # STEP 2: FACE RECOGNITION
-    # ============================================================================
-
-    def find_matching_face(target_image: Image.Image, query_image: Image.Image) -> dict:
-        """
-        STEP 2: Find matching face in target image based on query face.
-        Returns: Face bbox dict or None
-        """
-        print(f"[STEP 2] Finding matching face...")
-
-        target_rgb = np.ascontiguousarray(target_image.convert("RGB"), dtype=np.uint8)
-        query_rgb = np.ascontiguousarray(query_image.convert("RGB"), dtype=np.uint8)
-
-        # Detect faces
-        target_locations = face_recognition.face_locations(target_rgb, model="cnn")
-        target_encodings = face_recognition.face_encodings(target_rgb, target_locations)
-
-        query_locations = face_recognition.face_locations(query_rgb, model="cnn")
-        if len(query_locations) == 0:
-            raise ValueError("No faces found in query image")
-
-        # Use largest face if multiple
-        if len(query_locations) > 1:
-            print(f"[STEP 2] Found {len(query_locations)} faces in query, using largest")
-            face_areas = [
-                ((bottom - top) * (right - left), idx)
-                for idx, (top, right, bottom, left) in enumerate(query_locations)
-            ]
-            face_areas.sort(reverse=True)
-            largest_idx = face_areas[0][1]
-            query_locations = [query_locations[largest_idx]]
-
-        query_encoding = face_recognition.face_encodings(query_rgb, query_locations)[0]
-
-        # Compare faces
-        distances = face_recognition.face_distance(target_encodings, query_encoding)
-        threshold = 0.6
-        matches = distances <= threshold
-
-        # Find best match
-        for i, ((top, right, bottom, left), is_match, dist) in enumerate(zip(target_locations, matches, distances)):
-            if is_match:
-                print(f"[STEP 2] Match found! Distance: {dist:.3f}")
-                return {
-                    'top': int(top),
-                    'right': int(right),
-                    'bottom': int(bottom),
-                    'left': int(left),
-                    'distance': float(dist)
-                }
-
-        print(f"[STEP 2] No matching face found (threshold={threshold})")
-        return None
-
-    # ============================================================================
-    # STEP 3: SELECT BEST MASK
-    # ============================================================================
-
-    def select_best_mask(masks: List[dict], face_bbox: dict, session_id: str) -> int:
-        """
-        STEP 3: Select the largest mask that has overlap with the detected face.
-        
-        Strategy:
-        1. Calculate overlap area between face bbox and each mask
-        2. Filter masks with significant overlap (>10% of face area)
-        3. Select the largest mask from those with overlap
-        
-        Returns: mask index
-        """
-        print(f"[STEP 3] Selecting best mask from {len(masks)} candidates...")
-
-        # Calculate face area and bbox
-        face_left = face_bbox['left']
-        face_right = face_bbox['right']
-        face_top = face_bbox['top']
-        face_bottom = face_bbox['bottom']
-        face_area = (face_right - face_left) * (face_bottom - face_top)
-        
-        print(f"[STEP 3] Face bbox: ({face_left}, {face_top}) to ({face_right}, {face_bottom}), area={face_area}")
-
-        mask_session_dir = MASK_DIR / session_id
-        overlapping_masks = []
-
-        for i, mask_data in enumerate(masks):
-            mask_path = mask_session_dir / f"mask_{i}.png"
-            mask_image = cv2.imread(str(mask_path), cv2.IMREAD_GRAYSCALE)
-
-            if mask_image is None:
-                continue
-
-            # Calculate overlap between face bbox and mask
-            h, w = mask_image.shape
-            
-            # Crop mask to face bbox region
-            crop_top = max(0, face_top)
-            crop_bottom = min(h, face_bottom)
-            crop_left = max(0, face_left)
-            crop_right = min(w, face_right)
-            
-            if crop_top >= crop_bottom or crop_left >= crop_right:
-                continue  # No overlap
-            
-            # Count pixels in the face region that are part of the mask
-            face_region = mask_image[crop_top:crop_bottom, crop_left:crop_right]
-            overlap_pixels = np.count_nonzero(face_region)
-            overlap_percentage = (overlap_pixels / face_area) * 100 if face_area > 0 else 0
-            
-            # Only consider masks with at least 10% overlap with face
-            if overlap_percentage >= 10:
-                overlapping_masks.append({
-                    'index': i,
-                    'area': mask_data['area'],
-                    'overlap_pixels': overlap_pixels,
-                    'overlap_percentage': overlap_percentage
-                })
-                print(f"  Mask {i}: Overlap={overlap_percentage:.1f}%, Mask area={mask_data['area']}")
-
-        if not overlapping_masks:
-            print(f"[STEP 3] WARNING: No masks with >10% overlap. Trying with face center point...")
-            # Fallback: just check if face center is in mask
-            face_center_x = (face_left + face_right) // 2
-            face_center_y = (face_top + face_bottom) // 2
-            
-            for i, mask_data in enumerate(masks):
-                mask_path = mask_session_dir / f"mask_{i}.png"
-                mask_image = cv2.imread(str(mask_path), cv2.IMREAD_GRAYSCALE)
-                if mask_image is None:
-                    continue
-                h, w = mask_image.shape
-                if 0 <= face_center_y < h and 0 <= face_center_x < w:
-                    if mask_image[face_center_y, face_center_x] > 0:
-                        overlapping_masks.append({
-                            'index': i,
-                            'area': mask_data['area'],
-                            'overlap_pixels': 1,
-                            'overlap_percentage': 0
-                        })
-            
-            if not overlapping_masks:
-                raise ValueError("No masks overlap with the detected face")
-
-        # Select the mask with the LARGEST AREA that has overlap
-        best = max(overlapping_masks, key=lambda x: x['area'])
-        print(f"[STEP 3] ✓ Selected mask {best['index']}: area={best['area']}, overlap={best['overlap_percentage']:.1f}%")
-
-        return best['index']
-
-    # ============================================================================
-    # STEP 4: LAMA INPAINTING
-    # ============================================================================
-
-    def inpaint_with_lama(image: Image.Image, mask: Image.Image, session_id: str, device: str = "cuda") -> Image.Image:
-        """
-        STEP 4: Inpaint using LaMa.
-        Returns: Inpainted image
-        """
-        print(f"[STEP 4] Inpainting with LaMa...")
-
-        # Create working directories
-        work_dir = OUTPUT_DIR / f"{session_id}_lama_in"
-        out_dir = OUTPUT_DIR / f"{session_id}_lama_out"
-        work_dir.mkdir(exist_ok=True, parents=True)
-        out_dir.mkdir(exist_ok=True, parents=True)
-
-        # Save image and mask
-        base_name = "image"
-        image.save(work_dir / f"{base_name}.png")
-        # Use cv2 to save mask to avoid PIL dtype issues
-        mask_array = np.array(mask)
-        print(f"[STEP 4] Mask array dtype: {mask_array.dtype}, shape: {mask_array.shape}")
-        if mask_array.dtype != np.uint8:
-            mask_array = mask_array.astype(np.uint8)
-        # Ensure it's 2D grayscale
-        if len(mask_array.shape) == 3:
-            mask_array = mask_array[:, :, 0]
-        success = cv2.imwrite(str(work_dir / f"{base_name}_mask001.png"), mask_array)
-        if not success:
-            raise RuntimeError(f"Failed to write mask file")
-        print(f"[STEP 4] Mask saved successfully")
-
-        # Run LaMa prediction
-        predict_py = LAMA_DIR / "bin" / "predict.py"
-        args = [
-            sys.executable, str(predict_py),
-            f"model.path={str(LAMA_MODEL_DIR)}",
-            f"indir={str(work_dir)}",
-            f"outdir={str(out_dir)}",
-            f"device={device}"
-        ]
-
-        env = os.environ.copy()
-        env["PYTHONPATH"] = str(LAMA_DIR)
-        env["TORCH_HOME"] = str(LAMA_DIR)
-
-        # Debug: List files in work_dir before LaMa
-        print(f"[STEP 4] Files in work_dir before LaMa:")
-        for f in work_dir.iterdir():
-            print(f"  - {f.name} ({f.stat().st_size} bytes)")
-
-        print(f"[STEP 4] Running LaMa...")
-        print(f"[STEP 4] Command: {' '.join(args)}")
-        proc = subprocess.run(args, env=env, capture_output=True, text=True)
-        print(f"[STEP 4] LaMa return code: {proc.returncode}")
-        print(f"[STEP 4] LaMa stdout: {proc.stdout}")
-        if proc.stderr:
-            print(f"[STEP 4] LaMa stderr: {proc.stderr}")
-        
-        # Debug: List files in out_dir after LaMa
-        print(f"[STEP 4] Files in out_dir after LaMa:")
-        if out_dir.exists():
-            for f in out_dir.iterdir():
-                print(f"  - {f.name} ({f.stat().st_size} bytes)")
-        else:
-            print(f"  - out_dir does not exist!")
-        
-        if proc.returncode != 0:
-            raise RuntimeError(f"LaMa prediction failed with return code {proc.returncode}")
-
-        # Load result - LaMa outputs with _mask suffix
-        # Try both possible output names
-        possible_outputs = [
-            out_dir / f"{base_name}_mask001.png",
-            out_dir / f"{base_name}.png",
-        ]
-        
-        result_path = None
-        for path in possible_outputs:
-            if path.exists():
-                result_path = path
-                break
-        
-        if result_path is None:
-            # List all possible output files for debugging
-            print(f"[STEP 4] Expected outputs: {[str(p) for p in possible_outputs]}")
-            print(f"[STEP 4] Available files in {out_dir}:")
-            if out_dir.exists():
-                for f in out_dir.rglob("*"):
-                    if f.is_file():
-                        print(f"  - {f.relative_to(out_dir)} ({f.stat().st_size} bytes)")
-            raise FileNotFoundError(f"LaMa output not found in {out_dir}")
-
-        print(f"[STEP 4] Loading result from: {result_path}")
-        result = Image.open(result_path)
-        
-        # Verify image is valid
-        result.verify()
-        # Reopen after verify (verify closes the file)
-        result = Image.open(result_path).convert("RGB")
-        
-        # Verify dimensions
-        print(f"[STEP 4] Result image size: {result.size}, mode: {result.mode}")
-        
-        # Cleanup
-        shutil.rmtree(work_dir, ignore_errors=True)
-        shutil.rmtree(out_dir, ignore_errors=True)
-
-        print(f"[STEP 4] Inpainting complete")
-        return result
+    # Targets per request. The UI uploads one; the batch/shard path stays ready for more,
+    # but raising this multiplies the GPU work a single request can queue.
+    MAX_TARGETS = 1
 
     # ============================================================================
     # WEB ENDPOINTS
@@ -489,8 +954,8 @@ def fastapi_app():
     async def health():
         """Health check endpoint."""
         return JSONResponse({
-            "status": "healthy" if _models_loaded else "initializing",
-            "models_loaded": _models_loaded
+            "status": "healthy",
+            "models_loaded": True
         })
 
     @web_app.get("/", response_class=HTMLResponse)
@@ -508,13 +973,12 @@ def fastapi_app():
         Process images using SAM + face_recognition + LaMa pipeline.
 
         Pipeline:
-        1. Segment target image with SAM
-        2. Match face from reference image
-        3. Select best mask containing face
-        4. Inpaint with LaMa
+        1. Match face from reference image
+        2. Segment that person with SAM
+        3. Inpaint with LaMa
         """
-        if len(targets) > 1:
-            raise HTTPException(status_code=400, detail="Maximum 1 target image allowed")
+        if len(targets) > MAX_TARGETS:
+            raise HTTPException(status_code=400, detail=f"Maximum {MAX_TARGETS} target image{'s' if MAX_TARGETS != 1 else ''} allowed")
 
         if session_id is None:
             session_id = str(uuid.uuid4())
@@ -522,104 +986,29 @@ def fastapi_app():
         print(f"[API] Processing session {session_id}: 1 reference + {len(targets)} target{'s' if len(targets) != 1 else ''}")
 
         try:
-            # Ensure models loaded
-            initialize_models()
-
-            # Load reference image - ensure proper format regardless of input
             ref_content = await reference.read()
-            ref_pil = Image.open(io.BytesIO(ref_content))
-            # Convert to RGB and create fresh copy to ensure clean memory layout
-            ref_image = Image.frombytes('RGB', ref_pil.size, ref_pil.convert('RGB').tobytes())
-            print(f"[API] Loaded reference image: {reference.filename}, size: {ref_image.size}")
-
-            results = []
 
-            for idx, target_file in enumerate(targets):
-                try:
-                    print(f"\n[API] Processing image {idx+1}/{len(targets)}: {target_file.filename}")
-
-                    # Load target image - ensure proper format regardless of input
-                    target_content = await target_file.read()
-                    target_pil = Image.open(io.BytesIO(target_content))
-                    # Convert to RGB and create fresh copy to ensure clean memory layout
-                    target_image = Image.frombytes('RGB', target_pil.size, target_pil.convert('RGB').tobytes())
-                    print(f"[API] Loaded target image: {target_file.filename}, size: {target_image.size}")
-
-                    # STEP 1: Segment
-                    masks = segment_image(target_image, f"{session_id}_{idx}")
-
-                    # STEP 2: Find face
-                    face_bbox = find_matching_face(target_image, ref_image)
-                    if face_bbox is None:
-                        raise ValueError("No matching face found")
-
-                    # STEP 3: Select mask
-                    mask_idx = select_best_mask(masks, face_bbox, f"{session_id}_{idx}")
-
-                    # Load selected mask
-                    mask_path = MASK_DIR / f"{session_id}_{idx}" / f"mask_{mask_idx}.png"
-                    # Load mask using cv2 and convert to PIL to avoid dtype issues
-                    mask_cv2 = cv2.imread(str(mask_path), cv2.IMREAD_GRAYSCALE)
-                    if mask_cv2 is None:
-                        raise ValueError(f"Could not load mask from {mask_path}")
-                    # Ensure array is contiguous and in correct format
-                    mask_array = np.ascontiguousarray(mask_cv2, dtype=np.uint8)
-                    mask_image = Image.fromarray(mask_array, mode='L')
-
-                    # STEP 4: Inpaint
-                    result_image = inpaint_with_lama(target_image, mask_image, f"{session_id}_{idx}")
-
-                    # Save result with proper format
-                    output_filename = f"{session_id}_{idx}_{uuid.uuid4()}.jpg"
-                    output_path = OUTPUT_DIR / output_filename
-                    
-                    # Ensure result_image is in RGB mode
-                    if result_image.mode != 'RGB':
-                        result_image = result_image.convert('RGB')
-                    
-                    # Save with explicit JPEG format
-                    result_image.save(output_path, format='JPEG', quality=95, optimize=False)
-                    
-                    # Verify file was saved and is valid
-                    if not output_path.exists():
-                        raise RuntimeError(f"Failed to save output file: {output_path}")
-                    
-                    file_size = output_path.stat().st_size
-                    if file_size == 0:
-                        raise RuntimeError(f"Output file is empty: {output_path}")
-                    
-                    # Verify the saved image can be opened
-                    try:
-                        verify_img = Image.open(output_path)
-                        verify_img.verify()
-                        verify_img = Image.open(output_path)  # Reopen after verify
-                        print(f"[API] Saved result to {output_path} ({file_size} bytes, {verify_img.size})")
-                    except Exception as e:
-                        raise RuntimeError(f"Saved image is corrupted: {e}")
-                    
-                    # Commit outputs volume after each save to persist the file
-                    outputs_volume.commit()
-                    print(f"[API] Volume committed for {output_filename}")
-
-                    results.append({
-                        "original": target_file.filename,
-                        "output": output_filename,
-                        "url": f"/outputs/{output_filename}"
-                    })
-
-                    print(f"[API] ✓ Image {idx} processed successfully")
-
-                except Exception as e:
-                    print(f"[API] ✗ Image {idx} failed: {str(e)}")
-                    import traceback
-                    traceback.print_exc()
-                    results.append({
-                        "original": target_file.filename,
-                        "error": str(e)
-                    })
-
-            outputs_volume.commit()
-            masks_volume.commit()
+            # Spread targets across GPU containers; each shard is SAM-encoded as one batch
+            payloads = [(idx, f.filename, await f.read()) for idx, f in enumerate(targets)]
+            num_shards = min(MAX_CONTAINERS, len(payloads))
+            shards = [payloads[i::num_shards] for i in range(num_shards)]
+            print(f"[API] Fanning out {len(payloads)} target(s) over {num_shards} container(s)")
+
+            results = [None] * len(targets)
+            if num_shards == 1:
+                # One shard: ship the reference with it and encode it there, in one round-trip
+                shard_results_list = [await PastImages().process_targets.remote.aio(
+                    session_id, None, shards[0], (reference.filename, ref_content)
+                )]
+            else:
+                # The reference face is the same for every shard, so encode it once up front
+                ref_bytes = await PastImages().encode_reference.remote.aio(reference.filename, ref_content)
+                shard_results_list = [r async for r in PastImages().process_targets.map.aio(
+                    [session_id] * num_shards, [ref_bytes] * num_shards, shards
+                )]
+            for shard_results in shard_results_list:
+                for idx, result in shard_results:
+                    results[idx] = result
 
             return JSONResponse({
                 "success": True,
@@ -638,18 +1027,19 @@ def fastapi_app():
     @web_app.get("/outputs/{filename}")
     async def get_output(filename: str):
         """Serve processed images."""
-        # Reload volume to ensure file is available
-        outputs_volume.reload()
-        
         file_path = OUTPUT_DIR / filename
-        
+
         print(f"[DOWNLOAD] Attempting to serve: {file_path}")
-        print(f"[DOWNLOAD] File exists: {file_path.exists()}")
-        
+
         if not file_path.resolve().is_relative_to(OUTPUT_DIR.resolve()):
             print(f"[DOWNLOAD] Access denied - path not in OUTPUT_DIR")
             raise HTTPException(status_code=403, detail="Access denied")
 
+        if not file_path.exists():
+            # Written by another container since our last view of the volume
+            outputs_volume.reload()
+            print(f"[DOWNLOAD] Reloaded volume, file exists: {file_path.exists()}")
+
         if not file_path.exists():
             # List available files for debugging
             print(f"[DOWNLOAD] File not found. Available files in {OUTPUT_DIR}:")
@@ -16,6 +16,7 @@ app = modal.App("past-messages")
 image = (
     modal.Image.debian_slim(python_version="3.11")
     .pip_install_from_requirements("requirements.txt")
+    .env({"PAST_MESSAGES_PDF_WORKERS": "2"})  # PDF extraction processes per container
     .add_local_dir("templates", remote_path="/root/templates")
     .add_local_dir("static", remote_path="/root/static")
     .add_local_file("parsers.py", remote_path="/root/parsers.py")
@@ -37,6 +38,7 @@ secrets = [
     min_containers=0,
     gpu="A10G",
     max_containers=1,
+    allow_concurrent_inputs=16,  # one container; overlapping requests share its event loop
     scaledown_window=300,
     volumes={
         "/app/generated": generated_volume,
@@ -50,24 +52,48 @@ def fastapi_app():
     This function is called by Modal to create the ASGI app.
     """
     import io
+    import re
+    import gzip
+    import logging
+    import mmap
+    import time
     import uuid
-    import json
+    import shutil
+    import asyncio
+    import tempfile
     import yaml
+    import orjson
+    import aiofiles
+    from collections import Counter, OrderedDict
     from pathlib import Path
     from datetime import datetime
-    from typing import Dict, List
+    from typing import AsyncIterator, Dict, List
 
     from fastapi import FastAPI, File, UploadFile, HTTPException, Request
-    from fastapi.responses import JSONResponse, HTMLResponse, FileResponse
+    from fastapi.responses import ORJSONResponse, HTMLResponse, FileResponse, Response
     from fastapi.staticfiles import StaticFiles
     from fastapi.templating import Jinja2Templates
     from starlette.middleware.cors import CORSMiddleware
-    from openai import OpenAI
+    from markupsafe import Markup, escape
+    from openai import AsyncOpenAI
 
     import parsers
 
+    # Per-request diagnostics go to DEBUG; set PAST_MESSAGES_LOG_LEVEL=DEBUG to see them
+    log = logging.getLogger("pastmessages")
+    if not log.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        log.addHandler(handler)
+        log.propagate = False
+    log.setLevel(os.environ.get("PAST_MESSAGES_LOG_LEVEL", "INFO").upper())
+
     # Initialize FastAPI
-    web_app = FastAPI(title="Past Messages - AI Continuation", version="1.0.0")
+    web_app = FastAPI(
+        title="Past Messages - AI Continuation",
+        version="1.0.0",
+        default_response_class=ORJSONResponse,
+    )
 
     # Mount static files
     web_app.mount("/static", StaticFiles(directory="/root/static"), name="static")
@@ -91,79 +117,166 @@ def fastapi_app():
     SESSION_DIR = GENERATED_DIR / "sessions"
     SESSION_DIR.mkdir(exist_ok=True, parents=True)
 
+    # Recently saved/loaded sessions, so upload -> generate on this container skips the volume.
+    # Only touched on the event loop (never from to_thread workers), so concurrent inputs need no lock
+    SESSION_CACHE_SIZE = 32
+    session_cache: "OrderedDict[str, dict]" = OrderedDict()
+
+    # Keep references to fire-and-forget tasks so they aren't garbage collected mid-flight
+    background_tasks = set()
+
     # Load config
     with open("/root/config.yml", "r") as f:
         config = yaml.safe_load(f)
 
+    # Inlined into every generated page; read once instead of per request
+    CSS_CONTENT = Path("/root/static/style.css").read_text(encoding="utf-8")
+
+    # Compiled Jinja macro for one chat bubble (templates/message.html); expects escape_message output
+    render_message = templates.get_template("message.html").module.message
+
+    # Page shell for generate_html; compiled once so rendering never touches the template loader
+    CONVERSATION_TEMPLATE = templates.get_template("conversation.html")
+
+    LINE_BREAK = Markup("<br>")
+
+    def escape_message(msg: Dict) -> Dict:
+        """
+        HTML-escape a message's fields once, up front, as Markup so the template doesn't
+        re-scan them. Newlines in the text become <br>.
+        """
+        return {
+            "sender": escape(msg["sender"]),
+            "message": escape(msg["message"]).replace("\n", LINE_BREAK),
+            "timestamp": escape(msg.get("timestamp", "")),
+        }
+
     # Initialize OpenAI client
-    client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+    client = AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+
+    def cache_session(session_id: str, data: dict):
+        """Insert a session into the in-process LRU cache."""
+        session_cache[session_id] = data
+        session_cache.move_to_end(session_id)
+        while len(session_cache) > SESSION_CACHE_SIZE:
+            session_cache.popitem(last=False)
+
+    # Reloads within this window of the last one are skipped (back-to-back loads, download retries)
+    VOLUME_RELOAD_TTL = 0.5
+    last_volume_reload = 0.0
+
+    def cached_reload(ttl: float = VOLUME_RELOAD_TTL) -> bool:
+        """Reload the generated volume unless this container reloaded it within `ttl` seconds."""
+        nonlocal last_volume_reload
+        now = time.monotonic()
+        if now - last_volume_reload <= ttl:
+            return False
+        generated_volume.reload()
+        last_volume_reload = now
+        return True
+
+    def commit_volume():
+        """Commit the generated volume, logging instead of raising (runs in the background)."""
+        try:
+            generated_volume.commit()
+            log.debug("[SESSION] Volume committed successfully")
+        except Exception as e:
+            log.error("[SESSION] Failed to commit volume: %s: %s", type(e).__name__, e)
+
+    # Session saves only mark the volume dirty; one delayed commit covers every save in the window,
+    # and generate_continuation's own commit picks up whatever is still pending
+    VOLUME_COMMIT_DELAY = 0.5
+    volume_commit_pending = False
+    # Concurrent inputs can overlap a debounced commit with generate_continuation's; run one at a time
+    volume_commit_lock = asyncio.Lock()
+
+    async def debounced_commit():
+        """Wait out the debounce window, then commit if nobody else has in the meantime."""
+        nonlocal volume_commit_pending
+        await asyncio.sleep(VOLUME_COMMIT_DELAY)
+        async with volume_commit_lock:
+            if volume_commit_pending:
+                volume_commit_pending = False
+                await asyncio.to_thread(commit_volume)
+
+    def schedule_volume_commit():
+        """Mark the volume dirty and schedule a debounced commit; must be called from the event loop."""
+        nonlocal volume_commit_pending
+        if volume_commit_pending:
+            return  # Already covered by the scheduled commit
+        volume_commit_pending = True
+        task = asyncio.get_running_loop().create_task(debounced_commit())
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+
+    async def commit_volume_now():
+        """Commit immediately, absorbing any pending debounced commit."""
+        nonlocal volume_commit_pending
+        async with volume_commit_lock:
+            volume_commit_pending = False
+            await asyncio.to_thread(generated_volume.commit)
+
+    def write_session_file(session_file: Path, temp_file: Path, payload: bytes):
+        """Blocking part of save_session: temp write + atomic rename."""
+        # Nothing else opens the per-session temp file, so no lock is needed
+        with open(temp_file, "wb") as f:
+            f.write(payload)
+
+        # Atomic rename
+        temp_file.rename(session_file)
+
+    async def save_session(session_id: str, data: dict):
+        """Save session data to the cache and to disk."""
+        cache_session(session_id, data)
 
-    def save_session(session_id: str, data: dict):
-        """Save session data to disk with file locking."""
-        import fcntl
         session_file = SESSION_DIR / f"{session_id}.json"
         temp_file = SESSION_DIR / f"{session_id}.tmp"
-        print(f"[SESSION] Attempting to save to: {session_file}")
-        print(f"[SESSION] Session dir exists: {SESSION_DIR.exists()}")
-        print(f"[SESSION] Session dir is writable: {os.access(SESSION_DIR, os.W_OK)}")
+        log.debug("[SESSION] Attempting to save to: %s", session_file)
 
         try:
-            # Write to temp file with exclusive lock
-            with open(temp_file, "w") as f:
-                fcntl.flock(f.fileno(), fcntl.LOCK_EX)  # Exclusive lock
-                json.dump(data, f)
-                fcntl.flock(f.fileno(), fcntl.LOCK_UN)  # Release lock
-
-            # Atomic rename
-            temp_file.rename(session_file)
-            print(f"[SESSION] Wrote session file, size: {session_file.stat().st_size} bytes")
-
-            # Commit volume changes
-            print(f"[SESSION] Committing volume...")
-            generated_volume.commit()
-            print(f"[SESSION] Volume committed successfully")
+            # Disk I/O runs on a worker thread so the event loop keeps serving requests
+            await asyncio.to_thread(write_session_file, session_file, temp_file, orjson.dumps(data))
+            log.debug("[SESSION] Wrote session file")
 
-            # Verify file exists after commit
-            if session_file.exists():
-                print(f"[SESSION] ✓ Session {session_id} saved and verified at {session_file}")
-            else:
-                print(f"[SESSION] ✗ WARNING: Session file disappeared after commit!")
+            # Commit volume changes; only other containers need them, so don't wait
+            log.debug("[SESSION] Scheduling debounced volume commit...")
+            schedule_volume_commit()
 
         except Exception as e:
-            print(f"[SESSION] ERROR saving session: {type(e).__name__}: {str(e)}")
-            import traceback
-            traceback.print_exc()
+            log.exception("[SESSION] Failed to save session: %s: %s", type(e).__name__, e)
             raise
 
     def load_session(session_id: str) -> dict:
-        """Load session data from disk."""
+        """Load session data from the cache, falling back to disk."""
+        if session_id in session_cache:
+            session_cache.move_to_end(session_id)
+            log.debug("[SESSION] ✓ Session %s served from cache", session_id)
+            return session_cache[session_id]
+
         # Reload volume to get latest data
-        print(f"[SESSION] Reloading volume to get latest data...")
         try:
-            generated_volume.reload()
-            print(f"[SESSION] Volume reloaded successfully")
+            if cached_reload():
+                log.debug("[SESSION] Volume reloaded successfully")
         except Exception as e:
-            print(f"[SESSION] Warning: Volume reload failed: {e}")
+            log.warning("[SESSION] Volume reload failed: %s", e)
 
         session_file = SESSION_DIR / f"{session_id}.json"
-        print(f"[SESSION] Attempting to load from: {session_file}")
-        print(f"[SESSION] Session dir exists: {SESSION_DIR.exists()}")
-        print(f"[SESSION] Session dir contents: {list(SESSION_DIR.glob('*.json'))}")
+        log.debug("[SESSION] Attempting to load from: %s", session_file)
 
         if not session_file.exists():
-            print(f"[SESSION] ✗ Session file not found: {session_file}")
-            print(f"[SESSION] Available session files: {[f.name for f in SESSION_DIR.glob('*.json')]}")
+            log.warning("[SESSION] ✗ Session file not found: %s", session_file)
+            # Globbing stats every session file; only worth it when debugging
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug("[SESSION] Available session files: %s", [f.name for f in SESSION_DIR.glob('*.json')])
             return None
 
         try:
-            with open(session_file, "r") as f:
-                data = json.load(f)
-            print(f"[SESSION] ✓ Loaded session {session_id}, message count: {data.get('message_count', 0)}")
+            data = orjson.loads(session_file.read_bytes())
+            cache_session(session_id, data)
+            log.info("[SESSION] ✓ Loaded session %s, message count: %s", session_id, data.get('message_count', 0))
             return data
         except Exception as e:
-            print(f"[SESSION] ERROR loading session: {type(e).__name__}: {str(e)}")
-            import traceback
-            traceback.print_exc()
+            log.exception("[SESSION] Failed to load session: %s: %s", type(e).__name__, e)
             return None
 
     @web_app.get("/", response_class=HTMLResponse)
@@ -177,32 +290,33 @@ def fastapi_app():
         Upload and parse message file.
         Returns parsed message data and session ID.
         """
-        print(f"[API] Upload request received for file: {file.filename}")
-        print(f"[API] Content type: {file.content_type}")
+        log.info("[API] Upload request received for file: %s", file.filename)
+        log.debug("[API] Content type: %s", file.content_type)
 
         try:
-            # Read file content
-            content = await file.read()
-            print(f"[API] File size: {len(content)} bytes")
-
-            # Check if this is a PDF file
-            is_pdf = content[:4] == b'%PDF' or file.filename.lower().endswith('.pdf')
-
-            if is_pdf:
-                print("[API] Detected PDF file, passing bytes to parser")
-                content_str = ""  # Will be extracted by parser
-            else:
-                content_str = content.decode('utf-8', errors='ignore')
-                print(f"[API] Decoded to {len(content_str)} characters")
-
-            # Parse messages
-            print("[API] Calling parser...")
-            result = parsers.parse_messages(content_str, file.filename, content_bytes=content)
-            print(f"[API] Parser returned format: {result.get('format')}, messages: {result.get('message_count')}")
+            # Stream the upload to disk in 1 MB chunks instead of buffering it in memory
+            with tempfile.TemporaryFile() as tmp:
+                await asyncio.to_thread(shutil.copyfileobj, file.file, tmp, 1024 * 1024)
+                tmp.flush()  # mmap sees the fd, not Python's write buffer
+                size = tmp.tell()
+                log.debug("[API] File size: %s bytes", size)
+
+                # mmap can't map an empty file; the parser reports the empty upload itself
+                content = mmap.mmap(tmp.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+                try:
+                    # The parser extracts PDF text and decodes other formats itself; WhatsApp
+                    # exports are scanned straight from the mapped pages without a full decode
+                    log.debug("[API] Calling parser...")
+                    # Parsing a large export or PDF takes seconds; keep the event loop serving other requests
+                    result = await asyncio.to_thread(parsers.parse_messages, "", file.filename, content_bytes=content)
+                    log.debug("[API] Parser returned format: %s, messages: %s", result.get('format'), result.get('message_count'))
+                finally:
+                    if size:
+                        content.close()
 
             if result["format"] == "unknown":
                 error_detail = result.get("error", "Could not detect message format")
-                print(f"[API] ERROR: Format unknown - {error_detail}")
+                log.error("[API] Format unknown - %s", error_detail)
                 raise HTTPException(
                     status_code=400,
                     detail=f"{error_detail}. Supported: WhatsApp, iMessage (PDF), Facebook Messenger (JSON)"
@@ -210,7 +324,7 @@ def fastapi_app():
 
             if result["message_count"] == 0:
                 error_detail = result.get("error", "No messages found in file")
-                print(f"[API] ERROR: No messages - {error_detail}")
+                log.error("[API] No messages - %s", error_detail)
                 raise HTTPException(
                     status_code=400,
                     detail=error_detail
@@ -218,62 +332,47 @@ def fastapi_app():
 
             # Generate session ID
             session_id = str(uuid.uuid4())
-            print(f"[API] Generated session ID: {session_id}")
+            log.info("[API] Generated session ID: %s", session_id)
 
             # Store parsed messages persistently
-            save_session(session_id, result)
-            print(f"[API] Stored messages for session {session_id}")
+            await save_session(session_id, result)
+            log.debug("[API] Stored messages for session %s", session_id)
 
-            # Also return the full data in response for immediate use
-            # This avoids volume reload timing issues
+            # Messages stay server-side (session cache + volume); the client only needs a preview
             response_data = {
                 "session_id": session_id,
                 "format": result["format"],
                 "message_count": result["message_count"],
                 "participants": result["participants"],
-                "messages": result["messages"]  # Include full message data
+                "preview": result["messages"][:5]
             }
-            print(f"[API] Returning success response with {len(result['messages'])} messages")
+            log.info("[API] Returning success response for %s messages", result['message_count'])
 
-            return JSONResponse(response_data)
+            return response_data
 
         except UnicodeDecodeError as e:
-            print(f"[API] ERROR: Unicode decode failed: {str(e)}")
+            log.error("[API] Unicode decode failed: %s", e)
             raise HTTPException(status_code=400, detail="File encoding not supported")
         except HTTPException:
             # Re-raise HTTP exceptions without wrapping
             raise
         except Exception as e:
-            print(f"[API] ERROR: Unexpected exception: {type(e).__name__}: {str(e)}")
-            import traceback
-            traceback.print_exc()
+            log.exception("[API] Unexpected exception: %s: %s", type(e).__name__, e)
             raise HTTPException(status_code=500, detail=f"Error processing file: {str(e)}")
 
     @web_app.post("/api/generate/{session_id}")
-    async def generate_continuation(session_id: str, request: Request):
+    async def generate_continuation(session_id: str):
         """
         Generate AI continuation for the uploaded messages.
-        Accepts session data in request body to avoid volume persistence issues.
+        Session data comes from the in-process cache, falling back to the volume.
         Returns HTML file path for download.
         """
-        print(f"[API] Generate request for session: {session_id}")
+        log.info("[API] Generate request for session: %s", session_id)
 
-        # Try to get session data from request body first (preferred method)
-        try:
-            body = await request.body()
-            if body:
-                result = json.loads(body)
-                print(f"[API] Using session data from request body: {result.get('message_count')} messages")
-            else:
-                # Fall back to loading from volume
-                print(f"[API] No body data, loading from volume...")
-                result = load_session(session_id)
-        except Exception as e:
-            print(f"[API] Error parsing request body: {e}, falling back to volume")
-            result = load_session(session_id)
+        result = load_session(session_id)
 
         if result is None:
-            print(f"[API] ERROR: Session {session_id} not found")
+            log.error("[API] Session %s not found", session_id)
             raise HTTPException(status_code=404, detail=f"Session not found. Please upload the file again.")
 
         try:
@@ -290,78 +389,110 @@ def fastapi_app():
             conversation_context = build_conversation_context(messages, participants)
 
             # Call GPT-5.1 for continuation
-            print(f"[INFO] Generating continuation with GPT-5.1...")
+            log.info("[API] Generating continuation with GPT-5.1...")
             system_prompt = config["system_prompt"]
             temperature = config.get("temperature", 0.8)
             max_tokens = config.get("max_tokens", 2000)
 
-            response = client.chat.completions.create(
+            stream = await client.chat.completions.create(
                 model="gpt-4.1",  # GPT-5.1
                 messages=[
                     {"role": "system", "content": system_prompt},
                     {"role": "user", "content": conversation_context}
                 ],
                 temperature=temperature,
-                max_tokens=max_tokens
+                max_tokens=max_tokens,
+                stream=True
             )
 
-            continuation_text = response.choices[0].message.content
+            # Render the original messages while the model is still generating
+            left_participant = escape(participants[0])
+            escaped_messages = [escape_message(msg) for msg in messages]
+            original_html = [render_message(msg, left_participant) for msg in escaped_messages]
 
-            # Parse generated messages
-            ai_messages = parse_generated_messages(continuation_text, participants)
+            # Parse and render each generated message as soon as the next one starts
+            ai_messages = []
+            ai_html = []
+            async for msg in parse_generated_messages(stream_lines(stream), participants):
+                ai_messages.append(msg)
+                ai_html.append(render_message(escape_message(msg), left_participant, is_ai=True))
 
             # Generate HTML
             html_filename = f"conversation_{session_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.html"
             html_path = GENERATED_DIR / html_filename
 
-            html_content = generate_html(messages, ai_messages, participants, result["format"])
+            html_content = generate_html(original_html, ai_html, participants, result["format"])
 
-            with open(html_path, "w", encoding="utf-8") as f:
-                f.write(html_content)
+            # Stored pre-compressed; download_html serves the .gz bytes directly
+            compressed = await asyncio.to_thread(gzip.compress, html_content.encode("utf-8"), 6)
+            async with aiofiles.open(html_path.with_suffix(".html.gz"), "wb") as f:
+                await f.write(compressed)
 
-            # Commit volume changes
-            generated_volume.commit()
+            # Commit volume changes (also covers this session's file if its commit is still pending)
+            await commit_volume_now()
 
-            return JSONResponse({
+            return {
                 "success": True,
                 "filename": html_filename,
                 "download_url": f"/generated/{html_filename}",
                 "original_count": len(messages),
                 "generated_count": len(ai_messages)
-            })
+            }
 
         except Exception as e:
-            print(f"[ERROR] Generation failed: {str(e)}")
+            log.exception("[API] Generation failed: %s", e)
             raise HTTPException(status_code=500, detail=f"Error generating continuation: {str(e)}")
 
     @web_app.get("/generated/{filename}")
-    async def download_html(filename: str):
-        """Serve generated HTML file for download."""
-        import time
-
+    async def download_html(filename: str, request: Request):
+        """
+        Serve generated HTML file for download.
+        Files are stored gzipped and sent as-is with Content-Encoding: gzip when the client
+        accepts it; otherwise they're decompressed on the way out.
+        """
         # Security: prevent directory traversal
         file_path = GENERATED_DIR / filename
         if not file_path.resolve().is_relative_to(GENERATED_DIR.resolve()):
-            print(f"[DOWNLOAD] ERROR: Directory traversal attempt blocked")
+            log.error("[DOWNLOAD] Directory traversal attempt blocked")
             raise HTTPException(status_code=403, detail="Access denied")
+        gz_path = file_path.with_name(file_path.name + ".gz")
+        accepts_gzip = "gzip" in request.headers.get("accept-encoding", "")
 
-        # Retry logic to handle volume sync latency
-        max_retries = 3
+        # Retry with exponential backoff to handle volume sync latency
+        max_retries = 5
+        delay = 0.1
         for attempt in range(max_retries):
-            print(f"[DOWNLOAD] Attempt {attempt + 1}/{max_retries} for file: {filename}")
-
-            # Reload volume to get latest files
-            try:
-                generated_volume.reload()
-                print(f"[DOWNLOAD] Volume reloaded successfully")
-            except Exception as e:
-                print(f"[DOWNLOAD] Warning: Volume reload failed: {e}")
-
-            print(f"[DOWNLOAD] Looking for file at: {file_path}")
-            print(f"[DOWNLOAD] File exists: {file_path.exists()}")
+            log.debug("[DOWNLOAD] Attempt %s/%s for file: %s", attempt + 1, max_retries, filename)
+
+            # The first attempt usually hits a file this container just wrote; reload only on retries
+            if attempt > 0:
+                try:
+                    if cached_reload():
+                        log.debug("[DOWNLOAD] Volume reloaded successfully")
+                except Exception as e:
+                    log.warning("[DOWNLOAD] Volume reload failed: %s", e)
+
+            log.debug("[DOWNLOAD] Looking for file at: %s", gz_path)
+
+            if gz_path.exists():
+                log.info("[DOWNLOAD] ✓ Found file: %s", gz_path.name)
+                if accepts_gzip:
+                    return FileResponse(
+                        path=gz_path,
+                        filename=filename,
+                        media_type="text/html",
+                        headers={"Content-Encoding": "gzip", "Vary": "Accept-Encoding"}
+                    )
+                content = await asyncio.to_thread(lambda: gzip.decompress(gz_path.read_bytes()))
+                return Response(
+                    content=content,
+                    media_type="text/html",
+                    headers={"Content-Disposition": f'attachment; filename="{filename}"', "Vary": "Accept-Encoding"}
+                )
 
+            # Files generated before compression was added
             if file_path.exists():
-                print(f"[DOWNLOAD] ✓ Found file: {filename} ({file_path.stat().st_size} bytes)")
+                log.info("[DOWNLOAD] ✓ Found file: %s", filename)
                 return FileResponse(
                     path=file_path,
                     filename=filename,
@@ -370,13 +501,14 @@ def fastapi_app():
 
             # If not found, wait before retry (except on last attempt)
             if attempt < max_retries - 1:
-                print(f"[DOWNLOAD] File not found, waiting 2 seconds before retry...")
-                time.sleep(2)
+                log.debug("[DOWNLOAD] File not found, waiting %.1f seconds before retry...", delay)
+                await asyncio.sleep(delay)
+                delay *= 2
 
         # All retries exhausted
-        print(f"[DOWNLOAD] ERROR: File not found after {max_retries} attempts: {filename}")
-        print(f"[DOWNLOAD] Directory contents: {list(GENERATED_DIR.glob('*.html'))}")
-        print(f"[DOWNLOAD] Available files: {[f.name for f in GENERATED_DIR.glob('*.html')]}")
+        log.error("[DOWNLOAD] File not found after %s attempts: %s", max_retries, filename)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("[DOWNLOAD] Available files: %s", [f.name for f in GENERATED_DIR.glob('*.html*')])
         raise HTTPException(
             status_code=404,
             detail=f"File not found on server after {max_retries} attempts. The file may not have been generated successfully. Please try generating again."
@@ -386,153 +518,89 @@ def fastapi_app():
         """Build context string for GPT from message history."""
 
         # Count messages per participant to understand conversation dynamics
-        message_counts = {}
-        for msg in messages:
-            sender = msg["sender"]
-            message_counts[sender] = message_counts.get(sender, 0) + 1
+        message_counts = Counter(msg["sender"] for msg in messages)
 
         # Determine who speaks next (person who spoke last)
         last_sender = messages[-1]["sender"] if messages else participants[0]
 
-        context = f"CONVERSATION PARTICIPANTS: {' and '.join(participants)}\n\n"
-        context += f"YOU ARE SPEAKING AS: {last_sender}\n"
-        context += f"You are continuing this conversation from {last_sender}'s perspective.\n\n"
-
-        context += "CONVERSATION HISTORY:\n\n"
+        other = next(p for p in participants if p != last_sender)
 
-        for msg in messages[-50:]:  # Use last 50 messages for context
-            sender = msg["sender"]
-            message = msg["message"]
-            context += f"{sender}: {message}\n\n"
-
-        context += f"\n---\n\n"
-        context += f"As {last_sender}, continue this conversation naturally for 5-7 exchanges (10-14 messages total), "
-        context += f"alternating with {[p for p in participants if p != last_sender][0]}. "
-        context += f"Surface past challenges and unresolved tensions in your relationship. "
-        context += f"Maintain {last_sender}'s exact voice, tone, and communication style from the conversation above."
-
-        return context
+        # Use last 50 messages for context, indexing in place rather than slicing a copy
+        history = "\n\n".join(
+            f"{messages[i]['sender']}: {messages[i]['message']}"
+            for i in range(max(0, len(messages) - 50), len(messages))
+        )
 
-    def parse_generated_messages(text: str, participants: List[str]) -> List[Dict]:
-        """Parse GPT output into message structure."""
-        messages = []
-        lines = text.strip().split('\n')
+        return (
+            f"CONVERSATION PARTICIPANTS: {' and '.join(participants)}\n\n"
+            f"YOU ARE SPEAKING AS: {last_sender}\n"
+            f"You are continuing this conversation from {last_sender}'s perspective.\n\n"
+            f"CONVERSATION HISTORY:\n\n"
+            f"{history}\n\n"
+            f"\n---\n\n"
+            f"As {last_sender}, continue this conversation naturally for 5-7 exchanges (10-14 messages total), "
+            f"alternating with {other}. "
+            f"Surface past challenges and unresolved tensions in your relationship. "
+            f"Maintain {last_sender}'s exact voice, tone, and communication style from the conversation above."
+        )
 
+    async def stream_lines(stream) -> AsyncIterator[str]:
+        """Yield complete lines of text from a streaming chat completion as they arrive."""
+        buffer = ""
+        async for chunk in stream:
+            if not chunk.choices or not chunk.choices[0].delta.content:
+                continue
+            buffer += chunk.choices[0].delta.content
+            *lines, buffer = buffer.split("\n")
+            for line in lines:
+                yield line
+        if buffer:
+            yield buffer
+
+    async def parse_generated_messages(lines: AsyncIterator[str], participants: List[str]) -> AsyncIterator[Dict]:
+        """Parse GPT output lines into message structure, yielding each message once it is complete."""
         current_message = None
 
-        for line in lines:
+        # One anchored alternation over all names; longest first so a name that prefixes another can't shadow it
+        names = sorted(participants, key=len, reverse=True)
+        sender_line = re.compile(r"^(" + "|".join(re.escape(p) for p in names) + r"):\s*(.*)$")
+
+        async for line in lines:
             line = line.strip()
             if not line:
                 continue
 
             # Check if line starts with participant name
-            matched = False
-            for participant in participants:
-                if line.startswith(f"{participant}:"):
-                    # Save previous message
-                    if current_message:
-                        messages.append(current_message)
-
-                    # Start new message
-                    message_text = line[len(participant)+1:].strip()
-                    current_message = {
-                        "sender": participant,
-                        "message": message_text,
-                        "timestamp": "AI Generated",
-                        "ai_generated": True
-                    }
-                    matched = True
-                    break
-
-            # If no match, append to current message (multi-line)
-            if not matched and current_message:
+            match = sender_line.match(line)
+            if match:
+                # Emit previous message
+                if current_message:
+                    yield current_message
+
+                # Start new message
+                current_message = {
+                    "sender": match.group(1),
+                    "message": match.group(2),
+                    "timestamp": "AI Generated",
+                    "ai_generated": True
+                }
+            elif current_message:
+                # If no match, append to current message (multi-line)
                 current_message["message"] += "\n" + line
 
-        # Add last message
+        # Emit last message
         if current_message:
-            messages.append(current_message)
+            yield current_message
 
-        return messages
-
-    def generate_html(original_messages: List[Dict], ai_messages: List[Dict],
+    def generate_html(original_html: List[str], ai_html: List[str],
                      participants: List[str], format_type: str) -> str:
-        """Generate self-contained HTML with original + AI messages."""
-
-        # Read CSS
-        with open("/root/static/style.css", "r") as f:
-            css = f.read()
-
-        # Determine which participant is "left" vs "right"
-        left_participant = participants[0]
-        right_participant = participants[1] if len(participants) > 1 else participants[0]
-
-        def render_message(msg: Dict, is_ai: bool = False) -> str:
-            sender = msg["sender"]
-            message = msg["message"]
-            timestamp = msg.get("timestamp", "")
-
-            side = "left" if sender == left_participant else "right"
-            ai_class = " ai-generated" if is_ai else ""
-
-            html = f'<div class="message {side}{ai_class}">\n'
-            html += f'  <div class="message-sender">{sender}</div>\n'
-            html += f'  <div class="message-bubble">{message}'
-
-            if is_ai:
-                html += '<span class="ai-indicator">AI</span>'
-
-            html += '</div>\n'
-
-            if timestamp and timestamp != "AI Generated":
-                html += f'  <div class="message-timestamp">{timestamp}</div>\n'
-
-            html += '</div>\n'
-
-            return html
-
-        # Build HTML
-        html = f"""<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Past Messages - AI Continuation</title>
-    <style>
-{css}
-    </style>
-</head>
-<body>
-    <div class="chat-container">
-        <h1>Past Messages - AI Continuation</h1>
-        <p style="color: #666; margin-bottom: 30px;">
-            Original conversation ({format_type.title()}) with AI-generated continuation<br>
-            Between: {' and '.join(participants)}
-        </p>
-
-        <!-- Original Messages -->
-"""
-
-        for msg in original_messages:
-            html += render_message(msg)
-
-        html += """
-        <!-- AI Continuation Divider -->
-        <div class="section-divider">
-            AI-Generated Continuation
-        </div>
-
-"""
-
-        # AI Messages
-        for msg in ai_messages:
-            html += render_message(msg, is_ai=True)
-
-        html += """
-    </div>
-</body>
-</html>
-"""
-
-        return html
+        """Generate self-contained HTML from already rendered original + AI messages."""
+        return CONVERSATION_TEMPLATE.render(
+            css=CSS_CONTENT,
+            original_html=original_html,
+            ai_html=ai_html,
+            participants=participants,
+            format_type=format_type,
+        )
 
     return web_app
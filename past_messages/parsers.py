@@ -8,12 +8,81 @@ Supported formats:
 - Facebook Messenger: JSON exports (not yet implemented)
 """
 
+import io
+import os
 import json
 import re
+import hashlib
+from array import array
+from collections import OrderedDict
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from operator import itemgetter
 from datetime import datetime
 from typing import List, Dict, Optional
 from pathlib import Path
 
+
+# ==================== Compiled Patterns ====================
+
+# WhatsApp: [12/31/23, 10:30:45 PM] John: Hello there (US) / [08.06.24, 15:21:25] John: Hello there (EU)
+# One pattern for both date separators; supports with/without seconds and with/without AM/PM.
+# Possessive quantifiers (Python 3.11+) keep long lines without a ':' from backtracking.
+WHATSAPP_PATTERN = re.compile(r'\[(\d{1,2}[/.]\d{1,2}[/.]\d{2,4}),?\s++(\d{1,2}:\d{2}(?::\d{2})?+\s*+(?:[AP]M)?+)\]\s++([^:]++):\s*(.+)')
+
+# Loose prefix of WHATSAPP_PATTERN: every line WHATSAPP_PATTERN matches starts with it.
+# On raw UTF-8 bytes, any non-ASCII byte stands in for the Unicode digits that str \d accepts.
+WHATSAPP_START_EXPRESSION = rb'^\[[\d\x80-\xff]{1,8}[/.][\d\x80-\xff]{1,8}[/.][\d\x80-\xff]{2}'
+WHATSAPP_START_BYTES_PATTERN = re.compile(WHATSAPP_START_EXPRESSION, re.MULTILINE)
+WHATSAPP_START_PATTERN = re.compile(r'^\[\d{1,2}[/.]\d{1,2}[/.]\d{2}', re.MULTILINE)
+
+# WhatsApp system messages (encryption notice, media omitted, etc.), searched for in lowercased text.
+# Lowercasing once and matching case-sensitively is several times faster than re.IGNORECASE here.
+WHATSAPP_SKIP_PHRASES = (
+    "end-to-end encrypted",
+    "‎messages and calls",
+    "image omitted",
+    "video omitted",
+    "audio omitted",
+    "sticker omitted",
+    "gif omitted",
+    "document omitted",
+)
+WHATSAPP_SKIP_PATTERN = re.compile('|'.join(map(re.escape, WHATSAPP_SKIP_PHRASES)))
+
+# iMessage text lines: [Mon, Oct 27 at 10:36] You: Cool
+IMESSAGE_LINE_PATTERN = re.compile(r'\[([^\]]++)\]\s*+([^:]++):\s*(.+)')
+
+# Centered date/time headers in iMessage PDFs
+TIMESTAMP_PATTERNS = tuple(re.compile(p, re.IGNORECASE) for p in (
+    r'^(Mon|Tue|Wed|Thu|Fri|Sat|Sun),?\s+\w+\s+\d+\s+at\s+\d{1,2}:\d{2}',  # Mon, Oct 27 at 10:36
+    r'^(Mon|Tue|Wed|Thu|Fri|Sat|Sun)\s+\d+\.\s+\w+\s+at\s+\d{1,2}:\d{2}',  # Fri 19. Sep at 23:55
+    r'^(Monday|Tuesday|Wednesday|Thursday|Friday|Saturday|Sunday)\s+\d{1,2}:\d{2}',  # Wednesday 15:15
+    r'^(Yesterday|Today)\s+\d{1,2}:\d{2}',  # Today 14:18
+))
+# Lowercased first three letters of every line TIMESTAMP_PATTERNS can match
+TIMESTAMP_PREFIXES = frozenset({"mon", "tue", "wed", "thu", "fri", "sat", "sun", "yes", "tod"})
+
+# iMessage PDF labels that are not message text, compared against whole lowercased lines
+IMESSAGE_SKIP_PHRASES = frozenset({
+    "delivered quietly",
+    "notifications silenced",
+    "notify anyway",
+    "delivered",
+    "imessage",
+    "edited",
+})
+
+# File extension -> messenger format, and display names for logging
+FORMAT_BY_EXTENSION = {"json": "facebook", "pdf": "imessage", "txt": "whatsapp"}
+FORMAT_NAMES = {
+    "facebook": "Facebook Messenger (JSON)",
+    "imessage": "iMessage (PDF)",
+    "whatsapp": "WhatsApp (TXT)",
+}
+
+
 def detect_format(content: str, filename: str, is_pdf: bool = False) -> Optional[str]:
     """Auto-detect messenger format from file extension.
 
@@ -24,24 +93,19 @@ def detect_format(content: str, filename: str, is_pdf: bool = False) -> Optional
     """
 
     print(f"[PARSER] Detecting format for file: {filename}")
-    print(f"[PARSER] Content length: {len(content)} characters")
     print(f"[PARSER] Is PDF: {is_pdf}")
 
-    # Simple extension-based detection
-    filename_lower = filename.lower()
-
-    if filename_lower.endswith('.json'):
-        print("[PARSER] Detected format: Facebook Messenger (JSON)")
-        return "facebook"
-    elif filename_lower.endswith('.pdf') or is_pdf:
-        print("[PARSER] Detected format: iMessage (PDF)")
-        return "imessage"
-    elif filename_lower.endswith('.txt'):
-        print("[PARSER] Detected format: WhatsApp (TXT)")
-        return "whatsapp"
-    else:
+    # Simple extension-based detection; PDF magic bytes win over anything but .json
+    _, dot, extension = filename.lower().rpartition('.')
+    format_type = FORMAT_BY_EXTENSION.get(extension) if dot else None
+    if is_pdf and format_type != "facebook":
+        format_type = "imessage"
+
+    if format_type is None:
         print(f"[PARSER] ERROR: Unknown file extension for {filename}")
-        return None
+    else:
+        print(f"[PARSER] Detected format: {FORMAT_NAMES[format_type]}")
+    return format_type
 
 # PDF library imports
 PDF_LIBRARY = None
@@ -59,6 +123,13 @@ if PDF_LIBRARY is None:
     except ImportError:
         pass
 
+if PDF_LIBRARY is None:
+    try:
+        import pypdfium2 as pdfium
+        PDF_LIBRARY = "pypdfium2"
+    except ImportError:
+        pass
+
 if PDF_LIBRARY is None:
     try:
         from PyPDF2 import PdfReader
@@ -66,122 +137,247 @@ if PDF_LIBRARY is None:
     except ImportError:
         pass
 
+# Extracted PDF text, keyed by content hash. Memory only: uploads are private and must not
+# outlive the process. Parses run on worker threads, so the LRU is guarded by a lock
+PDF_CACHE_SIZE = 32
+pdf_text_cache: "OrderedDict[str, str]" = OrderedDict()
+pdf_text_cache_lock = threading.Lock()
+
+# Large PDFs are split across processes, at least this many pages per worker. os.cpu_count()
+# reports the host's CPUs, so the pool is sized from the CPUs this process may run on, capped
+# by PAST_MESSAGES_PDF_WORKERS (containers often get a fraction of what they can see).
+PAGES_PER_PDF_WORKER = 32
+PDF_WORKERS = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+if os.environ.get("PAST_MESSAGES_PDF_WORKERS"):
+    PDF_WORKERS = max(1, min(PDF_WORKERS, int(os.environ["PAST_MESSAGES_PDF_WORKERS"])))
+
+# Faster JSON decoding for Facebook exports when orjson is installed (it is in the Modal image)
+try:
+    import orjson
+    json_loads = orjson.loads  # orjson.JSONDecodeError subclasses json.JSONDecodeError
+except ImportError:
+    json_loads = json.loads
+
+# Optional Hyperscan backend for locating WhatsApp message starts (opt-in: `pip install hyperscan`;
+# results match the regex fallback, which is used when it is not installed)
+WHATSAPP_START_DB = None
+
+try:
+    import hyperscan
+    WHATSAPP_START_DB = hyperscan.Database()
+    WHATSAPP_START_DB.compile(
+        expressions=[WHATSAPP_START_EXPRESSION],
+        ids=[0],
+        elements=1,
+        flags=[hyperscan.HS_FLAG_MULTILINE | hyperscan.HS_FLAG_SOM_LEFTMOST],
+    )
+except ImportError:
+    pass
+
+# Optional Aho-Corasick automaton for the WhatsApp skip phrases (one pass regardless of phrase count;
+# opt-in: `pip install pyahocorasick`, otherwise WHATSAPP_SKIP_PATTERN is used)
+WHATSAPP_SKIP_AUTOMATON = None
+
+try:
+    import ahocorasick
+    WHATSAPP_SKIP_AUTOMATON = ahocorasick.Automaton()
+    for phrase in WHATSAPP_SKIP_PHRASES:
+        WHATSAPP_SKIP_AUTOMATON.add_word(phrase, phrase)
+    WHATSAPP_SKIP_AUTOMATON.make_automaton()
+except ImportError:
+    pass
+
+
 
 # ==================== PDF Extraction Functions ====================
 
-def extract_text_from_pdf_pymupdf(pdf_path):
+def open_pdf_stream(pdf_source):
+    """Turn PDF bytes into something every PDF library can open; paths pass through unchanged."""
+    if isinstance(pdf_source, (str, Path)):
+        return pdf_source
+    return io.BytesIO(pdf_source)
+
+
+def as_pdf_source(pdf_source):
+    """Normalize a PDF path or bytes-like object (e.g. an mmap) to a path or bytes that PyMuPDF and worker processes accept."""
+    if isinstance(pdf_source, (str, Path, bytes, bytearray)):
+        return pdf_source
+    return bytes(pdf_source)
+
+
+def open_pymupdf_document(pdf_source):
+    """Open a PDF with PyMuPDF from a path or straight from memory, without a temp file."""
+    if isinstance(pdf_source, (str, Path)):
+        return fitz.open(pdf_source)
+    return fitz.open(stream=as_pdf_source(pdf_source), filetype="pdf")
+
+
+def pdf_worker_count(page_count: int) -> int:
+    """Number of worker processes for a document; 1 means extract in-process."""
+    return max(1, min(PDF_WORKERS, page_count // PAGES_PER_PDF_WORKER))
+
+
+def map_page_ranges(worker, pdf_source, page_count: int, workers: int, *args) -> List:
+    """
+    Run worker(pdf_source, first, last, *args) over contiguous page ranges in a process pool.
+    Each worker reopens the PDF itself; results come back in page order.
+    """
+    step = -(-page_count // workers)
+    # Callers run on threads of a server process; forking it could copy held locks into the workers
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("forkserver")) as pool:
+        futures = [
+            pool.submit(worker, pdf_source, first, min(first + step, page_count), *args)
+            for first in range(0, page_count, step)
+        ]
+        return [future.result() for future in futures]
+
+
+def extract_text_pages_pymupdf(pdf_source, first: int, last: int) -> List[str]:
+    """Extract the text of pages [first, last) with PyMuPDF (process pool worker)."""
+    doc = open_pymupdf_document(pdf_source)
+    parts = [doc[page_index].get_text() for page_index in range(first, last)]
+    doc.close()
+    return parts
+
+
+def extract_text_from_pdf_pymupdf(pdf_source):
     """Extract text using PyMuPDF (fitz) - fastest and most accurate."""
-    doc = fitz.open(pdf_path)
-    text = ""
+    pdf_source = as_pdf_source(pdf_source)
+    doc = open_pymupdf_document(pdf_source)
+    workers = pdf_worker_count(doc.page_count)
+
+    if workers == 1:
+        parts = []
 
-    for page in doc:
-        text += page.get_text()
+        for page in doc:
+            parts.append(page.get_text())
 
+        doc.close()
+        return "".join(parts)
+
+    page_count = doc.page_count
     doc.close()
-    return text
+    print(f"[PARSER] Extracting {page_count} pages with {workers} worker processes")
+    chunks = map_page_ranges(extract_text_pages_pymupdf, pdf_source, page_count, workers)
+    return "".join(part for chunk in chunks for part in chunk)
 
 
-def extract_text_from_pdf_pdfplumber(pdf_path):
+def extract_text_from_pdf_pdfplumber(pdf_source):
     """Extract text using pdfplumber - good for complex layouts."""
-    text = ""
+    parts = []
 
-    with pdfplumber.open(pdf_path) as pdf:
+    with pdfplumber.open(open_pdf_stream(pdf_source)) as pdf:
         for page in pdf.pages:
             page_text = page.extract_text()
             if page_text:
-                text += page_text
+                parts.append(page_text)
 
-    return text
+    return "".join(parts)
+
+
+def extract_text_from_pdf_pypdfium2(pdf_source):
+    """Extract text using pypdfium2 - fast fallback, one text-range call per page."""
+    pdf = pdfium.PdfDocument(as_pdf_source(pdf_source))
+    parts = []
+
+    for page in pdf:
+        textpage = page.get_textpage()
+        # PDFium separates lines with \r\n; match the other backends
+        parts.append(textpage.get_text_range().replace("\r\n", "\n"))
+        textpage.close()
+        page.close()
+
+    pdf.close()
+    return "".join(parts)
 
 
-def extract_text_from_pdf_pypdf2(pdf_path):
+def extract_text_from_pdf_pypdf2(pdf_source):
     """Extract text using PyPDF2 - fallback option."""
-    reader = PdfReader(pdf_path)
-    text = ""
+    reader = PdfReader(open_pdf_stream(pdf_source))
+    parts = []
 
     for page in reader.pages:
         page_text = page.extract_text()
         if page_text:
-            text += page_text
+            parts.append(page_text)
 
-    return text
-
-
-def extract_imessage_from_pdf_pymupdf(
-    pdf_path,
-    right_label="You",
-    left_label="Them",
-    vertical_merge_threshold=15.0
-):
-    """
-    Extract an iMessage-style conversation using layout (left/right bubbles).
-    Requires PyMuPDF. Returns a list of message dicts.
+    return "".join(parts)
 
-    Args:
-        pdf_path: Path to PDF file
-        right_label: Label for messages on the right side (default: "You")
-        left_label: Label for messages on the left side (default: "Them")
-        vertical_merge_threshold: Max vertical distance to merge text blocks (default: 15.0)
-    """
-    if PDF_LIBRARY != "pymupdf":
-        raise RuntimeError(
-            "iMessage PDF extraction requires PyMuPDF (fitz). "
-            "Install with: pip install PyMuPDF"
-        )
 
-    doc = fitz.open(pdf_path)
-    messages = []
-    current_timestamp = "N/A"
+def empty_imessage_columns():
+    """Column store for iMessage layout records: one array/list per field instead of a dict per message."""
+    return {
+        "page": array('i'),
+        "y": array('d'),
+        "last_y": array('d'),
+        "right": array('b'),  # 1 = right-hand bubble, 0 = left
+        "text": [],
+        "timestamp": [],
+    }
 
-    # Timestamp patterns to detect centered date/time headers
-    timestamp_patterns = [
-        r'^(Mon|Tue|Wed|Thu|Fri|Sat|Sun),?\s+\w+\s+\d+\s+at\s+\d{1,2}:\d{2}',  # Mon, Oct 27 at 10:36
-        r'^(Mon|Tue|Wed|Thu|Fri|Sat|Sun)\s+\d+\.\s+\w+\s+at\s+\d{1,2}:\d{2}',  # Fri 19. Sep at 23:55
-        r'^(Monday|Tuesday|Wednesday|Thursday|Friday|Saturday|Sunday)\s+\d{1,2}:\d{2}',  # Wednesday 15:15
-        r'^(Yesterday|Today)\s+\d{1,2}:\d{2}',  # Today 14:18
-    ]
 
-    for page_index, page in enumerate(doc):
+def collect_imessage_blocks(doc, pages, vertical_merge_threshold, current_timestamp):
+    """
+    Layout pass of extract_imessage_from_pdf_pymupdf over the given page indices of an open document.
+    Returns the (unsorted, not yet deduplicated) message columns and the timestamp in effect after the last page.
+    """
+    columns = empty_imessage_columns()
+    col_page, col_y, col_last_y = columns["page"], columns["y"], columns["last_y"]
+    col_right, col_text, col_timestamp = columns["right"], columns["text"], columns["timestamp"]
+
+    def flush(page_index, y, last_y, right, text_parts, timestamp):
+        """Append the finished bubble to the columns."""
+        col_page.append(page_index)
+        col_y.append(y)
+        col_last_y.append(last_y)
+        col_right.append(right)
+        col_text.append(" ".join(text_parts))
+        col_timestamp.append(timestamp)
+
+    for page_index in pages:
+        page = doc[page_index]
         width = page.rect.width
+        # Top-to-bottom, then left-to-right; get_text(sort=True) would order by the bottom edge instead
         blocks = page.get_text("blocks")
-        blocks_sorted = sorted(blocks, key=lambda b: (b[1], b[0]))
-        current_msg = None
+        blocks.sort(key=itemgetter(1, 0))
 
-        for b in blocks_sorted:
+        # The bubble being built lives in plain locals; cur_parts is None until the first one starts
+        cur_parts = None
+        cur_y = cur_last_y = 0.0
+        cur_right = 0
+        cur_timestamp = current_timestamp
+
+        for b in blocks:
             x0, y0, x1, y1, text = b[0], b[1], b[2], b[3], b[4].strip()
             if not text:
                 continue
 
             # Filter block-level artifacts
-            if text.strip().lower() == "imessage":
+            if text.lower() == "imessage":
                 continue
 
-            # Check if any line in this block is a timestamp
-            has_timestamp = False
             filtered_lines = []
             for line in text.split('\n'):
                 line = line.strip()
                 if not line:
                     continue
 
-                # Check skip phrases
+                # Skip status labels ("Delivered", "Edited", ...)
                 lower = line.lower()
-                skip_phrases = ["delivered quietly", "notifications silenced", "notify anyway", "delivered", "imessage"]
-                if lower in skip_phrases:
-                    continue
-
-                # Skip "Edited" labels
-                if line.strip().lower() == "edited":
+                if lower in IMESSAGE_SKIP_PHRASES:
                     continue
 
-                # Check if timestamp
+                # Check if timestamp; only lines opening with a day word can match (non-ASCII
+                # openings still go to the regexes, whose IGNORECASE also folds e.g. U+017F to 's')
                 is_timestamp_line = False
-                for pattern in timestamp_patterns:
-                    if re.match(pattern, line, re.IGNORECASE):
-                        current_timestamp = line
-                        is_timestamp_line = True
-                        print(f"[PARSER] Detected timestamp: {current_timestamp}")
-                        break
+                head = lower[:3]
+                if head in TIMESTAMP_PREFIXES or not head.isascii():
+                    for pattern in TIMESTAMP_PATTERNS:
+                        if pattern.match(line):
+                            current_timestamp = line
+                            is_timestamp_line = True
+                            print(f"[PARSER] Detected timestamp: {current_timestamp}")
+                            break
 
                 if not is_timestamp_line:
                     filtered_lines.append(line)
@@ -196,64 +392,123 @@ def extract_imessage_from_pdf_pymupdf(
             # Decide which side the bubble is on
             # Use left edge position for more reliable detection
             margin_threshold = width * 0.3  # If x0 > 30% of width, it's on the right
-            side = "right" if x0 > margin_threshold else "left"
-            speaker = right_label if side == "right" else left_label
+            right = 1 if x0 > margin_threshold else 0
 
             # Merge into current message if same speaker & close vertically
             if (
-                current_msg is not None
-                and current_msg["speaker"] == speaker
-                and current_msg["page"] == page_index
-                and abs(y0 - current_msg["last_y"]) <= vertical_merge_threshold
+                cur_parts is not None
+                and cur_right == right
+                and abs(y0 - cur_last_y) <= vertical_merge_threshold
             ):
                 # Merge continuation text
-                current_msg["text"] += " " + message_text
-                current_msg["last_y"] = y1
+                cur_parts.append(message_text)
+                cur_last_y = y1
             else:
                 # Save previous message
-                if current_msg is not None:
-                    messages.append(current_msg)
+                if cur_parts is not None:
+                    flush(page_index, cur_y, cur_last_y, cur_right, cur_parts, cur_timestamp)
 
                 # Start new message
-                current_msg = {
-                    "page": page_index,
-                    "y": y0,
-                    "last_y": y1,
-                    "speaker": speaker,
-                    "text": message_text,
-                    "timestamp": current_timestamp,
-                }
+                cur_parts = [message_text]
+                cur_y, cur_last_y, cur_right = y0, y1, right
+                cur_timestamp = current_timestamp
 
         # Save last message on page
-        if current_msg is not None:
-            messages.append(current_msg)
-            current_msg = None
+        if cur_parts is not None:
+            flush(page_index, cur_y, cur_last_y, cur_right, cur_parts, cur_timestamp)
+
+    return columns, current_timestamp
 
+
+def extract_imessage_page_range(pdf_source, first, last, vertical_merge_threshold):
+    """
+    Process pool worker for pages [first, last). The timestamp in effect at `first` is unknown here,
+    so messages before the range's first header get timestamp None for the caller to fill in.
+    """
+    doc = open_pymupdf_document(pdf_source)
+    result = collect_imessage_blocks(doc, range(first, last), vertical_merge_threshold, None)
     doc.close()
-    messages = sorted(messages, key=lambda m: (m["page"], m["y"]))
+    return result
+
+
+def extract_imessage_from_pdf_pymupdf(
+    pdf_source,
+    right_label="You",
+    left_label="Them",
+    vertical_merge_threshold=15.0
+):
+    """
+    Extract an iMessage-style conversation using layout (left/right bubbles).
+    Requires PyMuPDF. Returns a list of message dicts.
+
+    Args:
+        pdf_source: Path to PDF file, or the PDF content as bytes
+        right_label: Label for messages on the right side (default: "You")
+        left_label: Label for messages on the left side (default: "Them")
+        vertical_merge_threshold: Max vertical distance to merge text blocks (default: 15.0)
+    """
+    if PDF_LIBRARY != "pymupdf":
+        raise RuntimeError(
+            "iMessage PDF extraction requires PyMuPDF (fitz). "
+            "Install with: pip install PyMuPDF"
+        )
+
+    pdf_source = as_pdf_source(pdf_source)
+    doc = open_pymupdf_document(pdf_source)
+    workers = pdf_worker_count(doc.page_count)
+
+    if workers == 1:
+        columns, _ = collect_imessage_blocks(doc, range(doc.page_count), vertical_merge_threshold, "N/A")
+        doc.close()
+    else:
+        page_count = doc.page_count
+        doc.close()
+        print(f"[PARSER] Extracting {page_count} iMessage pages with {workers} worker processes")
+        results = map_page_ranges(
+            extract_imessage_page_range, pdf_source, page_count, workers, vertical_merge_threshold
+        )
+
+        # Concatenate the ranges, carrying each range's last header into the next range's leading messages
+        columns = empty_imessage_columns()
+        current_timestamp = "N/A"
+        for range_columns, last_timestamp in results:
+            timestamps = range_columns["timestamp"]
+            for i, timestamp in enumerate(timestamps):
+                if timestamp is not None:
+                    break
+                timestamps[i] = current_timestamp
+            for field, column in columns.items():
+                column.extend(range_columns[field])
+            if last_timestamp is not None:
+                current_timestamp = last_timestamp
+
+    pages, ys, last_ys = columns["page"], columns["y"], columns["last_y"]
+    rights, texts, timestamps = columns["right"], columns["text"], columns["timestamp"]
+    order = sorted(range(len(texts)), key=lambda i: (pages[i], ys[i]))
 
     # Handle cross-page duplicates/continuations
     # When text spans pages, PyMuPDF sometimes duplicates the last line of page N
-    # at the start of page N+1. Merge these duplicates.
+    # at the start of page N+1. Merge these duplicates by dropping the shorter copy.
+    # Only pairs straddling a page break can qualify, so the cheap page/speaker checks
+    # run first and the string prefix test happens at most once per page.
+    # Records only become dicts here, for the messages that survive.
     deduplicated = []
-    i = 0
-    while i < len(messages):
-        current = messages[i]
-
-        # Check if there's a next message that might be a continuation
-        if i + 1 < len(messages):
-            next_msg = messages[i + 1]
-
-            # If same speaker and next message starts with current message's text
-            if (current["speaker"] == next_msg["speaker"] and
-                current["page"] + 1 == next_msg["page"] and
-                next_msg["text"].startswith(current["text"])):
-                # Skip current, keep next (which has the full text)
-                i += 1
-                continue
+    for current, following in zip(order, order[1:] + [None]):
+        if (following is not None and
+            pages[current] + 1 == pages[following] and
+            rights[current] == rights[following] and
+            texts[following].startswith(texts[current])):
+            # Skip current, keep next (which has the full text)
+            continue
 
-        deduplicated.append(current)
-        i += 1
+        deduplicated.append({
+            "page": pages[current],
+            "y": ys[current],
+            "last_y": last_ys[current],
+            "speaker": right_label if rights[current] else left_label,
+            "text": texts[current],
+            "timestamp": timestamps[current],
+        })
 
     return deduplicated
 
@@ -265,7 +520,7 @@ def extract_text_from_pdf(pdf_bytes, filename: str) -> str:
     layout-aware extraction, otherwise falls back to standard text extraction.
 
     Args:
-        pdf_bytes: PDF file content as bytes
+        pdf_bytes: PDF file content as bytes (or any bytes-like object)
         filename: Original filename for format detection
 
     Returns:
@@ -276,107 +531,179 @@ def extract_text_from_pdf(pdf_bytes, filename: str) -> str:
             "No PDF library installed! Install one:\n"
             "  pip install PyMuPDF  (recommended)\n"
             "  pip install pdfplumber\n"
+            "  pip install pypdfium2\n"
             "  pip install PyPDF2"
         )
 
-    # Save bytes to temporary file for PDF libraries
-    import tempfile
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp:
-        tmp.write(pdf_bytes)
-        tmp_path = tmp.name
+    # Check if this looks like an iMessage PDF (use layout-aware extraction)
+    layout = PDF_LIBRARY == "pymupdf" and ("imessage" in filename.lower() or "message" in filename.lower())
+
+    # The same export is often uploaded more than once; key on content + how it gets extracted
+    digest = hashlib.blake2b(pdf_bytes, digest_size=16).hexdigest()
+    cache_key = f"{digest}-{PDF_LIBRARY}-{'layout' if layout else 'text'}"
+    text = load_cached_pdf_text(cache_key)
+    if text is not None:
+        print(f"[PARSER] Using cached PDF text ({cache_key})")
+        return text
+
+    text = extract_text_from_pdf_uncached(pdf_bytes, layout)
+    store_cached_pdf_text(cache_key, text)
+    return text
+
+
+def extract_text_from_pdf_uncached(pdf_bytes, layout: bool) -> str:
+    """Run the actual extraction for extract_text_from_pdf (layout = iMessage layout-aware first)."""
+    if layout:
+        print("[PARSER] Detected iMessage PDF, using layout-aware extraction")
+        messages = extract_imessage_from_pdf_pymupdf(pdf_bytes)
+        if messages:
+            # Convert to text format
+            text_lines = []
+            for msg in messages:
+                sender = msg.get("speaker", "Unknown")
+                message = msg.get("text", "")
+                timestamp = msg.get("timestamp", "N/A")
+                text_lines.append(f"[{timestamp}] {sender}: {message}")
+            return "\n".join(text_lines)
+
+    # Standard text extraction for other PDFs
+    print(f"[PARSER] Extracting text from PDF using {PDF_LIBRARY}")
+    if PDF_LIBRARY == "pymupdf":
+        text = extract_text_from_pdf_pymupdf(pdf_bytes)
+    elif PDF_LIBRARY == "pdfplumber":
+        text = extract_text_from_pdf_pdfplumber(pdf_bytes)
+    elif PDF_LIBRARY == "pypdfium2":
+        text = extract_text_from_pdf_pypdfium2(pdf_bytes)
+    elif PDF_LIBRARY == "pypdf2":
+        text = extract_text_from_pdf_pypdf2(pdf_bytes)
+    else:
+        raise ValueError(f"Unknown PDF library: {PDF_LIBRARY}")
+
+    return text
 
-    try:
-        # Check if this looks like an iMessage PDF (use layout-aware extraction)
-        if "imessage" in filename.lower() or "message" in filename.lower():
-            if PDF_LIBRARY == "pymupdf":
-                print("[PARSER] Detected iMessage PDF, using layout-aware extraction")
-                messages = extract_imessage_from_pdf_pymupdf(tmp_path)
-                if messages:
-                    # Convert to text format
-                    text_lines = []
-                    for msg in messages:
-                        sender = msg.get("speaker", "Unknown")
-                        message = msg.get("text", "")
-                        timestamp = msg.get("timestamp", "N/A")
-                        text_lines.append(f"[{timestamp}] {sender}: {message}")
-                    return "\n".join(text_lines)
-
-        # Standard text extraction for other PDFs
-        print(f"[PARSER] Extracting text from PDF using {PDF_LIBRARY}")
-        if PDF_LIBRARY == "pymupdf":
-            text = extract_text_from_pdf_pymupdf(tmp_path)
-        elif PDF_LIBRARY == "pdfplumber":
-            text = extract_text_from_pdf_pdfplumber(tmp_path)
-        elif PDF_LIBRARY == "pypdf2":
-            text = extract_text_from_pdf_pypdf2(tmp_path)
-        else:
-            raise ValueError(f"Unknown PDF library: {PDF_LIBRARY}")
 
+def load_cached_pdf_text(cache_key: str) -> Optional[str]:
+    """Look up extracted PDF text in the in-memory LRU. Returns None on a miss."""
+    with pdf_text_cache_lock:
+        text = pdf_text_cache.get(cache_key)
+        if text is not None:
+            pdf_text_cache.move_to_end(cache_key)
         return text
 
-    finally:
-        # Clean up temp file
-        import os
-        try:
-            os.unlink(tmp_path)
-        except:
-            pass
 
+def store_cached_pdf_text(cache_key: str, text: str):
+    """Insert into the in-memory LRU, evicting the oldest entry past PDF_CACHE_SIZE."""
+    with pdf_text_cache_lock:
+        pdf_text_cache[cache_key] = text
+        pdf_text_cache.move_to_end(cache_key)
+        while len(pdf_text_cache) > PDF_CACHE_SIZE:
+            pdf_text_cache.popitem(last=False)
+
+
+def whatsapp_message_starts(data: bytes) -> List[int]:
+    """Byte offsets of every line that may start a WhatsApp message, found in one Hyperscan pass."""
+    starts = []
 
-def parse_whatsapp(content: str) -> List[Dict]:
-    """Parse WhatsApp chat export format."""
+    def on_match(pattern_id, start, end, flags, context):
+        if not starts or starts[-1] != start:
+            starts.append(start)
+
+    WHATSAPP_START_DB.scan(data, match_event_handler=on_match)
+    return starts
+
+
+def has_whatsapp_skip_phrase(lowered: str) -> bool:
+    """True if already-lowercased text contains a WhatsApp system-message phrase."""
+    if WHATSAPP_SKIP_AUTOMATON is not None:
+        return next(WHATSAPP_SKIP_AUTOMATON.iter(lowered), None) is not None
+    return WHATSAPP_SKIP_PATTERN.search(lowered) is not None
+
+
+def split_at_line_starts(buffer, starts):
+    """
+    Split a buffer at the given line-start offsets, dropping the newline before each one.
+    Splitting every chunk on newlines again gives exactly buffer.split(newline).
+    """
+    prev = 0
+    for start in starts:
+        if start:
+            yield buffer[prev:start - 1]
+        prev = start
+    yield buffer[prev:]
+
+
+def parse_whatsapp(content) -> List[Dict]:
+    """Parse WhatsApp chat export format.
+
+    content may be a str or raw UTF-8 bytes (any bytes-like object, such as an mmap).
+    Bytes are never decoded as a whole; each message chunk is decoded on its own.
+    """
     print("[PARSER] Starting WhatsApp parsing...")
     messages = []
 
-    # Patterns for both US and European date formats
-    # US: [12/31/23, 10:30:45 PM] John: Hello there
-    # EU: [08.06.24, 15:21:25] John: Hello there
-    # Pattern supports with/without seconds and with/without AM/PM
-    pattern_us = r'\[(\d{1,2}/\d{1,2}/\d{2,4}),?\s+(\d{1,2}:\d{2}(?::\d{2})?\s*(?:[AP]M)?)\]\s+([^:]+):\s*(.+)'
-    pattern_eu = r'\[(\d{1,2}\.\d{1,2}\.\d{2,4}),?\s+(\d{1,2}:\d{2}(?::\d{2})?\s*(?:[AP]M)?)\]\s+([^:]+):\s*(.+)'
-
-    lines = content.split('\n')
-    print(f"[PARSER] Total lines to process: {len(lines)}")
+    # Each chunk is a candidate message line plus the continuation lines after it; the starts
+    # come from one scan over the whole buffer (Hyperscan if available, else finditer)
+    if isinstance(content, str) and WHATSAPP_START_DB is None:
+        starts = [m.start() for m in WHATSAPP_START_PATTERN.finditer(content)]
+        chunks = split_at_line_starts(content, starts)
+    else:
+        data = content.encode("utf-8") if isinstance(content, str) else content
+        if WHATSAPP_START_DB is not None:
+            starts = whatsapp_message_starts(data)
+        else:
+            starts = [m.start() for m in WHATSAPP_START_BYTES_PATTERN.finditer(data)]
+        # Chunks end at newlines, so no UTF-8 sequence is split across two of them
+        chunks = (chunk.decode("utf-8", "ignore") for chunk in split_at_line_starts(data, starts))
+    print(f"[PARSER] Candidate message lines: {len(starts)}")
     current_message = None
     skipped_lines = 0
     matched_lines = 0
 
-    for line_num, line in enumerate(lines, 1):
+    for chunk in chunks:
+        line, has_rest, rest = chunk.partition('\n')
+
+        # Most chunks hold no system message; one check of the whole chunk clears every line in it
+        needs_filtering = has_whatsapp_skip_phrase(chunk.lower())
+
         # Skip WhatsApp system messages (encryption notice, media omitted, etc.)
-        if ("end-to-end encrypted" in line.lower() or
-            "‎messages and calls" in line.lower() or
-            "image omitted" in line.lower() or
-            "video omitted" in line.lower() or
-            "audio omitted" in line.lower() or
-            "sticker omitted" in line.lower() or
-            "gif omitted" in line.lower() or
-            "document omitted" in line.lower()):
+        if needs_filtering and has_whatsapp_skip_phrase(line.lower()):
             skipped_lines += 1
-            continue
-        # Try US format first
-        match = re.match(pattern_us, line)
-        if not match:
-            # Try EU format
-            match = re.match(pattern_eu, line)
+        else:
+            # US and EU date formats in a single match
+            match = WHATSAPP_PATTERN.match(line)
+
+            if match:
+                matched_lines += 1
+                date_str, time_str, sender, message = match.groups()
+
+                # Save previous message if exists
+                if current_message:
+                    messages.append(current_message)
+
+                # Create new message
+                timestamp = f"{date_str} {time_str}"
+                current_message = {
+                    "sender": sender.strip(),
+                    "message": message.strip(),
+                    "timestamp": timestamp
+                }
+            elif current_message:
+                # Continuation of previous message
+                current_message["message"] += "\n" + line
 
-        if match:
-            matched_lines += 1
-            date_str, time_str, sender, message = match.groups()
+        if not has_rest:
+            continue
 
-            # Save previous message if exists
+        # Remaining lines can't start a message; append them in one go unless one needs skipping
+        if not needs_filtering:
             if current_message:
-                messages.append(current_message)
-
-            # Create new message
-            timestamp = f"{date_str} {time_str}"
-            current_message = {
-                "sender": sender.strip(),
-                "message": message.strip(),
-                "timestamp": timestamp
-            }
-        elif current_message:
-            # Continuation of previous message
-            current_message["message"] += "\n" + line
+                current_message["message"] += "\n" + rest
+            continue
+        for line in rest.split('\n'):
+            if has_whatsapp_skip_phrase(line.lower()):
+                skipped_lines += 1
+            elif current_message:
+                current_message["message"] += "\n" + line
 
     # Add last message
     if current_message:
@@ -397,10 +724,6 @@ def parse_imessage(content: str) -> List[Dict]:
     """
     messages = []
 
-    # Pattern: [timestamp] Sender: Message
-    # Example: [Mon, Oct 27 at 10:36] You: Cool
-    pattern = r'\[([^\]]+)\]\s*([^:]+):\s*(.+)'
-
     lines = content.split('\n')
     current_message = None
 
@@ -409,7 +732,7 @@ def parse_imessage(content: str) -> List[Dict]:
         if not line:
             continue
 
-        match = re.match(pattern, line)
+        match = IMESSAGE_LINE_PATTERN.match(line)
         if match:
             if current_message:
                 messages.append(current_message)
@@ -432,6 +755,15 @@ def parse_imessage(content: str) -> List[Dict]:
 
 
 
+def format_timestamps_ms(values: List[int]) -> List[str]:
+    """
+    Format millisecond epoch timestamps as local "YYYY-MM-DD HH:MM:SS" strings ("Unknown" for 0).
+    isoformat() skips strftime's format-string parsing, which is most of the per-message cost.
+    """
+    fromtimestamp = datetime.fromtimestamp
+    return [fromtimestamp(ms / 1000.0).isoformat(" ", "seconds") if ms else "Unknown" for ms in values]
+
+
 def parse_facebook(content: str) -> List[Dict]:
     """Parse Facebook Messenger JSON export.
 
@@ -445,7 +777,7 @@ def parse_facebook(content: str) -> List[Dict]:
     messages = []
 
     try:
-        data = json.loads(content)
+        data = json_loads(content)
 
         if not isinstance(data, dict):
             print("[PARSER] ERROR: Expected JSON object at root")
@@ -458,6 +790,7 @@ def parse_facebook(content: str) -> List[Dict]:
         raw_messages = data["messages"]
         print(f"[PARSER] Found {len(raw_messages)} raw messages")
 
+        kept = []
         for msg in raw_messages:
             # Skip messages without content (reactions, call logs, etc.)
             if "content" not in msg:
@@ -468,20 +801,15 @@ def parse_facebook(content: str) -> List[Dict]:
             if "reagiert" in content or "reacted" in content.lower():
                 continue
 
-            sender = msg.get("sender_name", "Unknown")
-            timestamp_ms = msg.get("timestamp_ms", 0)
+            kept.append(msg)
 
-            # Convert timestamp from milliseconds to readable format
-            if timestamp_ms:
-                from datetime import datetime
-                dt = datetime.fromtimestamp(timestamp_ms / 1000.0)
-                timestamp = dt.strftime("%Y-%m-%d %H:%M:%S")
-            else:
-                timestamp = "Unknown"
+        # Convert timestamps from milliseconds to readable format in one batch
+        timestamps = format_timestamps_ms([msg.get("timestamp_ms", 0) for msg in kept])
 
+        for msg, timestamp in zip(kept, timestamps):
             messages.append({
-                "sender": sender,
-                "message": content,
+                "sender": msg.get("sender_name", "Unknown"),
+                "message": msg["content"],
                 "timestamp": timestamp
             })
 
@@ -504,9 +832,9 @@ def parse_messages(content: str, filename: str = "", content_bytes: bytes = None
     Main parser function that auto-detects format and returns parsed messages.
 
     Args:
-        content: Text content (or empty string if PDF)
+        content: Text content (or empty string if PDF or if content_bytes should be decoded here)
         filename: Original filename
-        content_bytes: Optional raw bytes (for PDF detection)
+        content_bytes: Optional raw bytes or other bytes-like object such as an mmap
 
     Returns:
         {
@@ -554,6 +882,10 @@ def parse_messages(content: str, filename: str = "", content_bytes: bytes = None
 
     format_type = detect_format(content, filename, is_pdf=is_pdf)
 
+    # Text exports may arrive undecoded; the WhatsApp parser works on the raw bytes directly
+    if not is_pdf and not content and content_bytes:
+        content = content_bytes if format_type == "whatsapp" else str(content_bytes, 'utf-8', errors='ignore')
+
     if not format_type:
         print("[PARSER] ERROR: Format detection failed")
         return {
@@ -586,8 +918,8 @@ def parse_messages(content: str, filename: str = "", content_bytes: bytes = None
             "error": f"Parsing failed: {str(e)}"
         }
 
-    # Extract unique participants
-    participants = list(set(msg["sender"] for msg in messages))
+    # Extract unique participants, in order of first appearance
+    participants = list(dict.fromkeys(msg["sender"] for msg in messages))
     print(f"[PARSER] Extracted {len(participants)} participants: {participants}")
 
     result = {
@@ -18,6 +18,8 @@ import argparse
 import subprocess
 import json
 import requests
+from bisect import bisect_right
+from itertools import accumulate
 from pathlib import Path
 from datetime import datetime
 from io import BytesIO
@@ -59,106 +61,63 @@ class FadingMemoryStyle:
     ]
 
     # Words that have thematic significance - more likely to fade
-    THEMATIC_WORDS = {
+    THEMATIC_WORDS = frozenset({
         'memory', 'past', 'future', 'present', 'remember', 'forget',
         'identity', 'change', 'transformation', 'control', 'history',
         'authentic', 'truth', 'real', 'alter', 'edit', 'rewrite',
         'malleable', 'narrative', 'reconstruct', 'erase', 'preserve',
         'orwell', 'stalin', 'trotsky', 'ai', 'algorithm'
-    }
+    })
 
     # Increase fade probability for thematic words
     THEMATIC_FADE_BOOST = 0.25
 
 
+# Markdown inline formatting
+# Order matters: code first (to protect it), then bold, then italic
+INLINE_FORMATTING_PATTERN = re.compile(r'(`[^`]+`|\*\*[^*]+\*\*|\*[^*]+\*|_[^_]+_)')
+
+# Running totals of FADE_LEVELS probabilities, and the (level, color) picked below each one;
+# a roll past the last total defaults to full opacity
+FADE_LEVEL_CUMULATIVE = tuple(accumulate(probability for _, probability, _ in FadingMemoryStyle.FADE_LEVELS))
+FADE_LEVEL_CHOICES = tuple((level, color) for level, _, color in FadingMemoryStyle.FADE_LEVELS) + (('full', '#000000'),)
+
+# Fade rolls come from the module-level generator, which main() and the title pages reseed
+# for reproducible patterns; binding its method once saves the attribute lookup per word
+fade_roll = random.random
+
+# Punctuation trimmed from both ends of a word before the thematic lookup
+WORD_PUNCTUATION = '.,!?;:"\'()[]{}'
+
+# Per-word fade probabilities, resolved once instead of on every word
+FADE_THRESHOLD = FadingMemoryStyle.FADE_PROBABILITY
+THEMATIC_FADE_THRESHOLD = FadingMemoryStyle.FADE_PROBABILITY + FadingMemoryStyle.THEMATIC_FADE_BOOST
+
+
 def should_fade_word(word):
     """Determine if a word should fade based on probability"""
     # Clean word for checking
-    clean_word = word.lower().strip('.,!?;:"\'()[]{}')
-
-    base_prob = FadingMemoryStyle.FADE_PROBABILITY
+    clean_word = word.lower().strip(WORD_PUNCTUATION)
 
     # Boost probability for thematic words
     if clean_word in FadingMemoryStyle.THEMATIC_WORDS:
-        base_prob += FadingMemoryStyle.THEMATIC_FADE_BOOST
-
-    return random.random() < base_prob
+        return fade_roll() < THEMATIC_FADE_THRESHOLD
+    return fade_roll() < FADE_THRESHOLD
 
 
 def get_fade_level():
     """Randomly select a fade level based on weighted probabilities"""
-    roll = random.random()
-    cumulative = 0
-
-    for level, probability, color in FadingMemoryStyle.FADE_LEVELS:
-        cumulative += probability
-        if roll < cumulative:
-            return level, color
-
-    # Default to full opacity
-    return 'full', '#000000'
+    return FADE_LEVEL_CHOICES[bisect_right(FADE_LEVEL_CUMULATIVE, fade_roll())]
 
 
 def escape_xml(text):
     """Escape XML special characters for ReportLab"""
-    text = text.replace('&', '&amp;')
-    text = text.replace('<', '&lt;')
-    text = text.replace('>', '&gt;')
+    # Most words contain none of them; skip the three copying passes for those
+    if '&' in text or '<' in text or '>' in text:
+        text = text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
     return text
 
 
-def process_inline_formatting(text):
-    """
-    Convert markdown inline formatting to ReportLab tags.
-    Handles: **bold**, *italic*, _italic_, `code`
-    Returns list of (type, content) tuples.
-    """
-    import re
-
-    # Pattern to match inline formatting
-    # Order matters: code first (to protect it), then bold, then italic
-    pattern = r'(`[^`]+`|\*\*[^*]+\*\*|\*[^*]+\*|_[^_]+_)'
-
-    parts = []
-    last_end = 0
-
-    for match in re.finditer(pattern, text):
-        # Add any text before this match
-        if match.start() > last_end:
-            parts.append(('text', text[last_end:match.start()]))
-
-        matched_text = match.group(1)
-
-        # Determine type and extract content
-        if matched_text.startswith('`') and matched_text.endswith('`'):
-            # Inline code
-            parts.append(('code', escape_xml(matched_text[1:-1])))
-        elif matched_text.startswith('**') and matched_text.endswith('**'):
-            # Bold
-            parts.append(('bold', matched_text[2:-2]))
-        elif matched_text.startswith('*') and matched_text.endswith('*'):
-            # Italic (asterisk)
-            parts.append(('italic', matched_text[1:-1]))
-        elif matched_text.startswith('_') and matched_text.endswith('_'):
-            # Italic (underscore)
-            parts.append(('italic', matched_text[1:-1]))
-        else:
-            # Shouldn't happen, but treat as text
-            parts.append(('text', matched_text))
-
-        last_end = match.end()
-
-    # Add any remaining text
-    if last_end < len(text):
-        parts.append(('text', text[last_end:]))
-
-    # If no formatting was found, return as plain text
-    if not parts:
-        parts.append(('text', text))
-
-    return parts
-
-
 def apply_fading_to_text_segment(text):
     """
     Apply fading to a plain text segment (no formatting).
@@ -173,17 +132,24 @@ def apply_fading_to_text_segment(text):
             continue
 
         # Decide if this word should have fading
+        escaped_word = escape_xml(word)
         if should_fade_word(word):
             level, color = get_fade_level()
-            escaped_word = escape_xml(word)
-            faded_word = f'<font color="{color}">{escaped_word}</font>'
-            faded_words.append(faded_word)
+            faded_words.append(f'<font color="{color}">{escaped_word}</font>')
         else:
-            faded_words.append(escape_xml(word))
+            faded_words.append(escaped_word)
 
     return ' '.join(faded_words)
 
 
+def fade_inline_text(text, is_heading):
+    """Fade plain or bold/italic content; headings are often left unfaded."""
+    if is_heading and fade_roll() > 0.3:
+        # Don't fade headings as much
+        return escape_xml(text)
+    return apply_fading_to_text_segment(text)
+
+
 def apply_fading_to_paragraph(text, is_heading=False):
     """
     Apply fading effect to text using ReportLab's inline color tags.
@@ -193,39 +159,32 @@ def apply_fading_to_paragraph(text, is_heading=False):
     if not text.strip():
         return text
 
-    # Process inline formatting (bold, italic, code)
-    parts = process_inline_formatting(text)
-
+    # Convert inline formatting and fade the text around it in a single pass
     result = []
-    for part_type, part_text in parts:
-        if part_type == 'code':
-            # Code - already escaped, don't fade
-            result.append(f'<font name="Courier" size="9">{part_text}</font>')
+    last_end = 0
+
+    for match in INLINE_FORMATTING_PATTERN.finditer(text):
+        # Regular text before this match - apply fading
+        if match.start() > last_end:
+            result.append(fade_inline_text(text[last_end:match.start()], is_heading))
 
-        elif part_type == 'bold':
+        matched_text = match.group(1)
+
+        if matched_text[0] == '`':
+            # Inline code - don't fade
+            result.append(f'<font name="Courier" size="9">{escape_xml(matched_text[1:-1])}</font>')
+        elif matched_text.startswith('**'):
             # Bold - apply fading to content, then wrap in <b>
-            if is_heading and random.random() > 0.3:
-                # Don't fade headings as much
-                result.append(f'<b>{escape_xml(part_text)}</b>')
-            else:
-                faded_content = apply_fading_to_text_segment(part_text)
-                result.append(f'<b>{faded_content}</b>')
+            result.append(f'<b>{fade_inline_text(matched_text[2:-2], is_heading)}</b>')
+        else:
+            # Italic (asterisk or underscore) - apply fading to content, then wrap in <i>
+            result.append(f'<i>{fade_inline_text(matched_text[1:-1], is_heading)}</i>')
 
-        elif part_type == 'italic':
-            # Italic - apply fading to content, then wrap in <i>
-            if is_heading and random.random() > 0.3:
-                result.append(f'<i>{escape_xml(part_text)}</i>')
-            else:
-                faded_content = apply_fading_to_text_segment(part_text)
-                result.append(f'<i>{faded_content}</i>')
-
-        else:  # 'text'
-            # Regular text - apply fading
-            if is_heading and random.random() > 0.3:
-                # Don't fade headings as much
-                result.append(escape_xml(part_text))
-            else:
-                result.append(apply_fading_to_text_segment(part_text))
+        last_end = match.end()
+
+    # Remaining regular text
+    if last_end < len(text):
+        result.append(fade_inline_text(text[last_end:], is_heading))
 
     return ''.join(result)
 
@@ -255,8 +214,10 @@ def parse_markdown_to_story(content, styles):
     in_list = False
 
     for line in lines:
+        stripped = line.strip()
+
         # Handle code blocks
-        if line.strip().startswith('```'):
+        if stripped.startswith('```'):
             in_code_block = not in_code_block
             if not in_code_block:
                 story.append(Spacer(1, 0.1*inch))
@@ -269,7 +230,7 @@ def parse_markdown_to_story(content, styles):
             continue
 
         # Empty lines
-        if not line.strip():
+        if not stripped:
             if in_list:
                 in_list = False
             story.append(Spacer(1, 0.08*inch))
@@ -296,12 +257,12 @@ def parse_markdown_to_story(content, styles):
             text = apply_fading_to_paragraph(line[2:])
             story.append(Paragraph(text, styles['Quote']))
         # Unordered list
-        elif line.strip().startswith('- ') or line.strip().startswith('* '):
+        elif stripped.startswith(('- ', '* ')):
             in_list = True
-            text = apply_fading_to_paragraph(line.strip()[2:])
+            text = apply_fading_to_paragraph(stripped[2:])
             story.append(Paragraph(f'• {text}', styles['Bullet']))
         # Horizontal rule
-        elif line.strip() in ['---', '***', '___']:
+        elif stripped in ('---', '***', '___'):
             story.append(Spacer(1, 0.1*inch))
             story.append(FadedLine(6*inch))
             story.append(Spacer(1, 0.1*inch))
@@ -314,31 +275,11 @@ def parse_markdown_to_story(content, styles):
     return story
 
 
-def create_pdf_document(input_file, output_file):
-    """Create a PDF with fading memory aesthetic from a markdown file"""
-
-    # Read the input file
-    with open(input_file, 'r', encoding='utf-8') as f:
-        content = f.read()
-
-    filename = Path(input_file).name
-    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-
-    # Create PDF
-    doc = SimpleDocTemplate(
-        str(output_file),
-        pagesize=letter,
-        rightMargin=0.75*inch,
-        leftMargin=0.75*inch,
-        topMargin=0.75*inch,
-        bottomMargin=0.75*inch,
-        title=f"{filename} - Fading Memory",
-    )
-
-    # Define styles
+def build_document_styles():
+    """Paragraph styles for the Markdown documents"""
     # Using Times-Roman/Times-Bold for headings (serif, similar to Garamond)
     # Using Helvetica for body text (sans-serif, similar to Inter)
-    styles = {
+    return {
         'Title': ParagraphStyle(
             'Title',
             fontName='Times-Bold',  # Garamond-like serif
@@ -414,6 +355,32 @@ def create_pdf_document(input_file, output_file):
         ),
     }
 
+
+# Identical for every document, so built once and shared by all of them
+DOCUMENT_STYLES = build_document_styles()
+
+
+def create_pdf_document(input_file, output_file, styles=DOCUMENT_STYLES):
+    """Create a PDF with fading memory aesthetic from a markdown file"""
+
+    # Read the input file
+    with open(input_file, 'r', encoding='utf-8') as f:
+        content = f.read()
+
+    filename = Path(input_file).name
+    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+    # Create PDF
+    doc = SimpleDocTemplate(
+        str(output_file),
+        pagesize=letter,
+        rightMargin=0.75*inch,
+        leftMargin=0.75*inch,
+        topMargin=0.75*inch,
+        bottomMargin=0.75*inch,
+        title=f"{filename} - Fading Memory",
+    )
+
     # Build story
     story = []
 